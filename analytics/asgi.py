@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'analytics.settings')
 
 application = get_asgi_application()
+
+# Only server processes load this module, so management commands skip the warm-up
+from core.apps import start_warm_up  # noqa: E402
+
+start_warm_up()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.QueryStatsMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.ReadReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,9 +85,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so a transaction that read first
+            # waits for busy_timeout instead of failing with "database is locked" on upgrade
+            'transaction_mode': os.environ.get('ANALYTICS_SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
     }
 }
 
+# Applied to every new SQLite connection by core.db.apply_sqlite_pragmas. WAL lets the
+# dashboard keep reading while bulk analysis writes; `manage.py sqlite_concurrency`
+# measures the effect. Set a value to '' to leave that pragma at the SQLite default.
+ANALYTICS_SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('ANALYTICS_SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('ANALYTICS_SQLITE_SYNCHRONOUS', 'normal'),  # Safe with WAL, fsyncs at checkpoints
+    'cache_size': os.environ.get('ANALYTICS_SQLITE_CACHE_SIZE', '-65536'),  # Negative values are KiB (64 MiB)
+    'mmap_size': os.environ.get('ANALYTICS_SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)),
+    'busy_timeout': os.environ.get('ANALYTICS_SQLITE_BUSY_TIMEOUT_MS', '5000'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -164,3 +185,153 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+
+
+# Analytics / ML models
+# Threads a single model may use for its batched predict calls
+ANALYTICS_INFERENCE_THREADS = int(os.environ.get('ANALYTICS_INFERENCE_THREADS', min(4, os.cpu_count() or 1)))
+
+# Maximum rows scored per sklearn/XGBoost predict call; compiled forests traverse in smaller batches
+ANALYTICS_INFERENCE_BATCH_SIZE = int(os.environ.get('ANALYTICS_INFERENCE_BATCH_SIZE', 50000))
+
+# Total threads one training run may use, split between models fitted concurrently
+ANALYTICS_TRAINING_CPU_BUDGET = int(os.environ.get('ANALYTICS_TRAINING_CPU_BUDGET', os.cpu_count() or 1))
+
+# Fit independent models concurrently instead of one after another
+ANALYTICS_PARALLEL_TRAINING = os.environ.get('ANALYTICS_PARALLEL_TRAINING', 'true').lower() == 'true'
+
+# Maximum training rows indexed by the LocalOutlierFactor neighbor tree
+ANALYTICS_LOF_MAX_TRAINING_ROWS = int(os.environ.get('ANALYTICS_LOF_MAX_TRAINING_ROWS', 20000))
+
+# Root of the versioned model registry
+ANALYTICS_MODEL_DIR = os.environ.get('ANALYTICS_MODEL_DIR', 'trained_models/')
+
+# Published model versions kept on disk; older ones are pruned after each training run
+ANALYTICS_MODEL_KEEP_VERSIONS = int(os.environ.get('ANALYTICS_MODEL_KEEP_VERSIONS', 5))
+
+# Serve the forests from memory-mapped NumPy arrays instead of unpickled estimators
+ANALYTICS_USE_COMPILED_FORESTS = os.environ.get('ANALYTICS_USE_COMPILED_FORESTS', 'true').lower() == 'true'
+
+# Maximum seconds django.setup() plus URL and command imports may take (checked by core.tests
+# when ANALYTICS_CHECK_IMPORT_TIME=1)
+ANALYTICS_IMPORT_TIME_BUDGET_SECONDS = float(os.environ.get('ANALYTICS_IMPORT_TIME_BUDGET_SECONDS', 1.0))
+
+# Preload models and score a synthetic batch in the background when a server process starts
+# (core.apps.start_warm_up, called from analytics/wsgi.py and asgi.py)
+ANALYTICS_WARMUP_ON_STARTUP = os.environ.get('ANALYTICS_WARMUP_ON_STARTUP', 'false').lower() == 'true'
+
+# Maximum rows in the stratified reservoir sample models are trained on
+ANALYTICS_TRAINING_MAX_ROWS = int(os.environ.get('ANALYTICS_TRAINING_MAX_ROWS', 500000))
+
+# Age at which an expense is half as likely as a new one to be kept in the training sample
+ANALYTICS_TRAINING_HALF_LIFE_DAYS = float(os.environ.get('ANALYTICS_TRAINING_HALF_LIFE_DAYS', 180))
+
+# 'full' refits the IsolationForest on the training sample every run; 'windowed' keeps a rolling
+# ensemble that only fits new rows and drops generations older than the window
+ANALYTICS_ISOLATION_FOREST_MODE = os.environ.get('ANALYTICS_ISOLATION_FOREST_MODE', 'full')
+
+# Age in hours after which windowed isolation forest generations are dropped
+ANALYTICS_WINDOWED_FOREST_WINDOW_HOURS = float(os.environ.get('ANALYTICS_WINDOWED_FOREST_WINDOW_HOURS', 168))
+
+# Trees fitted per windowed isolation forest generation
+ANALYTICS_WINDOWED_FOREST_TREES = int(os.environ.get('ANALYTICS_WINDOWED_FOREST_TREES', 25))
+
+# New rows and sheets required before a training run adds a windowed isolation forest
+# generation; features are computed per sheet, so a generation must span several sheets
+ANALYTICS_WINDOWED_FOREST_MIN_ROWS = int(os.environ.get('ANALYTICS_WINDOWED_FOREST_MIN_ROWS', 5000))
+ANALYTICS_WINDOWED_FOREST_MIN_SHEETS = int(os.environ.get('ANALYTICS_WINDOWED_FOREST_MIN_SHEETS', 5))
+
+# Population stability index of any feature above which scheduled training retrains
+ANALYTICS_DRIFT_PSI_THRESHOLD = float(os.environ.get('ANALYTICS_DRIFT_PSI_THRESHOLD', 0.2))
+
+# Rows and sheets that must be analyzed against a model version before its drift report is
+# acted on; features are computed per sheet, so a single sheet is never representative
+ANALYTICS_DRIFT_MIN_ROWS = int(os.environ.get('ANALYTICS_DRIFT_MIN_ROWS', 2000))
+ANALYTICS_DRIFT_MIN_SHEETS = int(os.environ.get('ANALYTICS_DRIFT_MIN_SHEETS', 5))
+
+# Prometheus metrics are served at /metrics. With multiple worker processes, export
+# PROMETHEUS_MULTIPROC_DIR (an empty, writable directory) before the workers start so
+# every worker's samples are aggregated into one scrape.
+
+# Logging: JSON lines (or plain text) written by a background thread so request
+# handling never blocks on log I/O
+ANALYTICS_LOG_LEVEL = os.environ.get('ANALYTICS_LOG_LEVEL', 'INFO').upper()
+ANALYTICS_LOG_FORMAT = os.environ.get('ANALYTICS_LOG_FORMAT', 'json')  # 'json' or 'text'
+ANALYTICS_LOG_FILE = os.environ.get('ANALYTICS_LOG_FILE') or None  # stderr when unset
+
+# Fraction of per-row DEBUG events (individual upload rows, logger core.views.rows) that are kept
+ANALYTICS_LOG_ROW_SAMPLE_RATE = float(os.environ.get('ANALYTICS_LOG_ROW_SAMPLE_RATE', 0.01))
+
+# Per-module overrides, e.g. "core.views=DEBUG,core.analytics=WARNING"
+ANALYTICS_LOG_LEVELS = {
+    name.strip(): {'level': level.strip().upper()}
+    for name, _, level in (
+        item.partition('=') for item in os.environ.get('ANALYTICS_LOG_LEVELS', '').split(',')
+    )
+    if name.strip() and level.strip()
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.logging_utils.JsonFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'filters': {
+        'row_sampling': {'()': 'core.logging_utils.SamplingFilter', 'rate': ANALYTICS_LOG_ROW_SAMPLE_RATE},
+    },
+    'handlers': {
+        'async': {
+            '()': 'core.logging_utils.AsyncQueueHandler',
+            'filename': ANALYTICS_LOG_FILE,
+            'formatter': ANALYTICS_LOG_FORMAT,
+        },
+    },
+    'root': {'handlers': ['async'], 'level': 'WARNING'},
+    'loggers': {
+        'django': {'level': 'INFO'},
+        'core': {'level': ANALYTICS_LOG_LEVEL},
+        # Per-row events only; other loggers' DEBUG records are not sampled
+        'core.views.rows': {'filters': ['row_sampling']},
+        **ANALYTICS_LOG_LEVELS,
+    },
+}
+
+# Per-request SQL statistics (core.middleware.QueryStatsMiddleware): requests issuing more
+# statements than the warning count, or any statement slower than the threshold, are logged
+ANALYTICS_QUERY_COUNT_WARNING = int(os.environ.get('ANALYTICS_QUERY_COUNT_WARNING', 50))
+ANALYTICS_SLOW_QUERY_SECONDS = float(os.environ.get('ANALYTICS_SLOW_QUERY_SECONDS', 0.25))
+ANALYTICS_QUERY_STATS_SLOWEST = int(os.environ.get('ANALYTICS_QUERY_STATS_SLOWEST', 3))
+
+# On-demand request profiling (core.middleware.ProfilingMiddleware): requests sending this
+# token in the X-Profile header (or ?profile=) are profiled. Disabled when empty; prefer
+# the header, since query strings end up in access logs.
+ANALYTICS_PROFILING_TOKEN = os.environ.get('ANALYTICS_PROFILING_TOKEN', '')
+ANALYTICS_PROFILE_DIR = os.environ.get('ANALYTICS_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+ANALYTICS_PROFILER = os.environ.get('ANALYTICS_PROFILER', 'cprofile')  # 'cprofile' or 'sampling'
+ANALYTICS_PROFILE_SAMPLE_INTERVAL = float(os.environ.get('ANALYTICS_PROFILE_SAMPLE_INTERVAL', 0.005))
+
+# Allocation sites reported per stage by the tracemalloc memory profile
+# (analyze_sheets --memory-profile, or ?memory=1 on analysis endpoints when DEBUG or
+# profiling is authorized)
+ANALYTICS_MEMORY_PROFILE_TOP = int(os.environ.get('ANALYTICS_MEMORY_PROFILE_TOP', 10))
+
+# Optional read replica: path of a second SQLite database that read-only requests are served
+# from (core.db.ReadReplicaRouter), keeping dashboard reads off the primary while bulk analyses
+# write. `manage.py sync_replica` refreshes it from the primary, e.g. from cron.
+ANALYTICS_READ_REPLICA_DB = os.environ.get('ANALYTICS_READ_REPLICA_DB', '')
+# A client that wrote reads from the primary until a sync_replica run includes its write,
+# for at most this long; keep it above the sync interval
+ANALYTICS_READ_YOUR_WRITES_SECONDS = float(os.environ.get('ANALYTICS_READ_YOUR_WRITES_SECONDS', 86400))
+# Where sync_replica records the snapshot time of the replica (default: next to the replica)
+ANALYTICS_REPLICA_SYNC_FILE = os.environ.get('ANALYTICS_REPLICA_SYNC_FILE', '')
+
+if ANALYTICS_READ_REPLICA_DB:
+    DATABASES['replica'] = {
+        'ENGINE': DATABASES['default']['ENGINE'],
+        'NAME': ANALYTICS_READ_REPLICA_DB,
+        # Tests read and write one database
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['core.db.ReadReplicaRouter']
@@ -1,6 +1,47 @@
+import logging
+import threading
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .db import apply_sqlite_pragmas
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='core.apply_sqlite_pragmas')
+
+
+def start_warm_up():
+    """Warm up models in a background thread when ANALYTICS_WARMUP_ON_STARTUP is set
+
+    Called from the WSGI/ASGI entry points (which runserver also loads), so management
+    commands and the test runner never pay for it. Servers that load the application
+    before forking workers, like gunicorn --preload, should call it from a post_fork hook
+    instead, since the thread does not survive the fork.
+    """
+    if not getattr(settings, 'ANALYTICS_WARMUP_ON_STARTUP', False):
+        return None
+    # Warm up in the background so the server starts accepting requests immediately
+    thread = threading.Thread(target=_warm_up, name='analytics-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def _warm_up():
+    from .analytics import warm_up_models
+
+    try:
+        report = warm_up_models()
+        logger.info(
+            "Analytics warm-up completed in %.2fs (load %.2fs, scoring %.2fs, model version %s)",
+            report['total_seconds'], report['load_seconds'], report['scoring_seconds'], report['model_version'],
+            extra=report
+        )
+    except Exception:
+        logger.exception("Analytics warm-up failed")
@@ -0,0 +1,119 @@
+import contextvars
+import logging
+import os
+import re
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+# Pragmas the connection hook may set; anything else in the setting is rejected
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'busy_timeout', 'temp_store', 'wal_autocheckpoint')
+
+_PRAGMA_VALUE = re.compile(r'^(-?\d+|[A-Za-z]+)$')
+
+# Database alias of the read replica, configured by ANALYTICS_READ_REPLICA_DB
+REPLICA_ALIAS = 'replica'
+
+_use_replica = contextvars.ContextVar('analytics_use_replica', default=False)
+
+
+def pragma_statements(pragmas):
+    """``PRAGMA`` statements for a mapping of pragma name to value, validated"""
+    statements = []
+    for name, value in pragmas.items():
+        if value is None or value == '':
+            continue
+        if name not in SQLITE_PRAGMAS:
+            raise ValueError(f'Unsupported SQLite pragma: {name}')
+        if not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f'Invalid value for SQLite pragma {name}: {value!r}')
+        statements.append(f'PRAGMA {name} = {value}')
+    return statements
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """connection_created receiver applying ``ANALYTICS_SQLITE_PRAGMAS`` to new SQLite connections
+
+    journal_mode=WAL lets readers keep reading while a long analysis transaction writes,
+    and busy_timeout makes writers queue for the lock instead of failing immediately.
+    The journal mode is persistent in the database file; the other pragmas are per connection.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'ANALYTICS_SQLITE_PRAGMAS', None)
+    if not pragmas:
+        return
+    raw = connection.connection
+    for statement in pragma_statements(pragmas):
+        raw.execute(statement)
+    if pragmas.get('journal_mode'):
+        mode = raw.execute('PRAGMA journal_mode').fetchone()[0]
+        # In-memory databases (tests) cannot use WAL and keep their 'memory' journal
+        if mode.lower() != str(pragmas['journal_mode']).lower() and mode.lower() != 'memory':
+            logger.warning("SQLite journal_mode is %s, not %s", mode, pragmas['journal_mode'])
+
+
+def replica_configured():
+    """Whether a read replica separate from the primary is configured
+
+    Test runs make the replica a mirror of the test database, which reads the primary.
+    """
+    if REPLICA_ALIAS not in settings.DATABASES:
+        return False
+    return connections[REPLICA_ALIAS].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+
+def _replica_sync_file():
+    return getattr(settings, 'ANALYTICS_REPLICA_SYNC_FILE', '') or f"{settings.DATABASES[REPLICA_ALIAS]['NAME']}.synced"
+
+
+def record_replica_sync(snapshot_time):
+    """Record that the replica now holds every write committed before ``snapshot_time``"""
+    path = _replica_sync_file()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(f'{snapshot_time:.6f}')
+    os.replace(tmp_path, path)
+
+
+def last_replica_sync():
+    """Snapshot time of the last completed ``sync_replica``, or None before the first one"""
+    try:
+        with open(_replica_sync_file()) as f:
+            return float(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def use_replica(enabled=True):
+    """Route ORM reads in this context to the read replica (when one is configured)"""
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReadReplicaRouter:
+    """Send reads inside ``use_replica()`` to the replica alias and everything else to the primary
+
+    Reads default to the primary, so analyses, training and management commands always see
+    their own writes; ReadReplicaMiddleware opts read-only requests in. The replica is a copy
+    of the primary (see ``manage.py sync_replica``), so it is never migrated directly.
+    """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA_ALIAS if _use_replica.get() else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,126 @@
+import json
+import os
+from datetime import datetime, timezone
+from .lazy_imports import lazy_import
+from .locking import file_lock
+
+np = lazy_import('numpy')
+
+BASELINE_FILE = 'drift_baseline.json'
+DEFAULT_BINS = 10
+
+# Floor for empty bins so the PSI log term stays finite
+PSI_EPSILON = 1e-4
+
+# Features computed relative to their own sheet (counts, z-score and rank within the sheet)
+# or to the calendar. Their histogram over a few sheets differs from the one pooled over
+# all training sheets even when nothing changed, so they are not monitored.
+UNMONITORED_FEATURES = frozenset([
+    'amount_zscore', 'amount_percentile', 'employee_frequency', 'vendor_frequency', 'category_frequency', 'month'
+])
+
+# Factor by which the statistical anomaly rate may move from the training rate
+ANOMALY_RATE_TOLERANCE = 2.0
+
+
+def build_baseline(X, feature_columns, n_bins=DEFAULT_BINS, statistical_anomaly_rate=None):
+    """Quantile bin edges and reference counts per monitored feature of a training matrix"""
+    X = np.asarray(X, dtype=np.float64)
+    features = {}
+    for j, col in enumerate(feature_columns):
+        if col in UNMONITORED_FEATURES:
+            continue
+        values = X[:, j]
+        # Low-cardinality features (codes, flags) collapse to fewer, distinct edges
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])) if len(values) else np.array([])
+        features[col] = {'edges': edges.tolist(), 'counts': _bin_counts(values, edges).tolist()}
+    return {'rows': int(len(X)), 'statistical_anomaly_rate': statistical_anomaly_rate, 'features': features}
+
+
+def _bin_counts(values, edges):
+    edges = np.asarray(edges, dtype=np.float64)
+    return np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+
+
+def population_stability_index(expected_counts, actual_counts):
+    """PSI between two histograms over the same bins"""
+    expected = np.asarray(expected_counts, dtype=np.float64)
+    actual = np.asarray(actual_counts, dtype=np.float64)
+    expected = np.maximum(expected / max(expected.sum(), 1.0), PSI_EPSILON)
+    actual = np.maximum(actual / max(actual.sum(), 1.0), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+class DriftMonitor:
+    """Running per-feature histograms of analyzed rows compared with the training baseline
+
+    Each analyzed sheet adds its rows to counters binned like the baseline of the served
+    model version. The counters live in one small JSON file shared by every process, so
+    reading the drift report costs the same no matter how much data has been analyzed.
+    Counters restart whenever a new model version (and so a new baseline) is served.
+    """
+
+    def __init__(self, path, baseline, version):
+        self.path = path
+        self.baseline = baseline
+        self.version = version
+        # Baselines written before a feature was unmonitored still carry it
+        self.features = {col: spec for col, spec in baseline['features'].items() if col not in UNMONITORED_FEATURES}
+
+    def _empty_state(self):
+        return {
+            'model_version': self.version,
+            'rows': 0,
+            'sheets': 0,
+            'statistical_anomalies': 0,
+            'updated_at': None,
+            'counts': {col: [0] * len(spec['counts']) for col, spec in self.features.items()}
+        }
+
+    def _read_state(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get('model_version') == self.version:
+                return state
+        return self._empty_state()
+
+    def update(self, X, feature_columns, statistical_anomalies=0):
+        """Add the rows of one analyzed sheet to the running histograms"""
+        X = np.asarray(X, dtype=np.float64)
+        with file_lock(self.path + '.lock'):
+            state = self._read_state()
+            for j, col in enumerate(feature_columns):
+                spec = self.features.get(col)
+                if spec is None:
+                    continue
+                counts = np.asarray(state['counts'][col]) + _bin_counts(X[:, j], spec['edges'])
+                state['counts'][col] = counts.tolist()
+            state['rows'] += int(len(X))
+            state['sheets'] += 1
+            state['statistical_anomalies'] += int(statistical_anomalies)
+            state['updated_at'] = datetime.now(timezone.utc).isoformat()
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+    def report(self):
+        """PSI per feature plus the counters since the current version was served"""
+        state = self._read_state()
+        psi = {
+            col: population_stability_index(spec['counts'], state['counts'][col]) if state['rows'] else 0.0
+            for col, spec in self.features.items()
+        }
+        return {
+            'model_version': self.version,
+            'baseline_rows': self.baseline['rows'],
+            'rows': state['rows'],
+            'sheets': state['sheets'],
+            'statistical_anomaly_rate': state['statistical_anomalies'] / state['rows'] if state['rows'] else 0.0,
+            'baseline_statistical_anomaly_rate': self.baseline.get('statistical_anomaly_rate'),
+            'updated_at': state['updated_at'],
+            'max_psi': max(psi.values()) if psi else 0.0,
+            'psi': psi
+        }
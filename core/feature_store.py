@@ -0,0 +1,256 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+from .lazy_imports import lazy_import
+from .locking import file_lock
+
+np = lazy_import('numpy')
+
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+
+# Bumped when the on-disk layout changes; part of the schema key so old stores are pruned
+STORE_FORMAT = 2
+
+# Column files appended in lockstep; ``features`` holds ``n_features`` values per row
+ARRAY_DTYPES = {
+    'features': 'float64',
+    'labels': 'int8',
+    'timestamps': 'float64',
+    'expense_ids': 'int64'
+}
+
+
+def schema_key(feature_columns, version):
+    """Short stable key identifying a feature layout"""
+    payload = json.dumps({'columns': list(feature_columns), 'version': version, 'format': STORE_FORMAT}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class FeatureStore:
+    """Append-only encoded training matrix backed by memory-mapped NumPy files
+
+    Rows live under ``<root>/<schema key>/`` so a change in feature layout starts a new
+    store instead of mixing incompatible rows. Rows are stored per expense sheet along
+    with a fingerprint of the sheet's expenses: appending a sheet again supersedes its
+    previous rows and removing it drops them, since features depend on the whole sheet.
+    Superseded rows stay in the column files as dead rows until ``compact`` rewrites the
+    live rows into a new epoch of files.
+
+    Appends are written to the column files first and only become visible once
+    ``commit`` atomically rewrites ``meta.json`` with the new row count, sheet ranges and
+    vocabulary; a crash in between leaves a tail that the next writer truncates when it
+    takes the lock.
+    """
+
+    def __init__(self, root, feature_columns, categorical_columns, version):
+        self.root = root
+        self.feature_columns = list(feature_columns)
+        self.n_features = len(self.feature_columns)
+        self.schema = schema_key(self.feature_columns, version)
+        self.directory = os.path.join(root, self.schema)
+        self.categorical_columns = list(categorical_columns)
+        os.makedirs(self.directory, exist_ok=True)
+        self._reset_pending()
+        self._load_meta()
+
+    def _reset_pending(self):
+        self._pending_rows = 0
+        self._pending_sheets = {}
+        self._pending_removals = set()
+
+    def _load_meta(self):
+        meta_path = os.path.join(self.directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {
+                'schema': self.schema,
+                'feature_columns': self.feature_columns,
+                'n_rows': 0,
+                'epoch': 0,
+                'watermark': 0,
+                'sheets': {},  # sheet id -> {'start', 'end', 'fingerprint'}
+                'vocabulary': {}
+            }
+        for col in self.categorical_columns:
+            self.meta['vocabulary'].setdefault(col, [])
+
+    @property
+    def n_rows(self):
+        """Rows in the column files, including dead rows; row positions are below this"""
+        return self.meta['n_rows']
+
+    @property
+    def n_live_rows(self):
+        return sum(entry['end'] - entry['start'] for entry in self.meta['sheets'].values())
+
+    @property
+    def epoch(self):
+        """Incremented by ``compact``, which moves rows to new positions"""
+        return self.meta['epoch']
+
+    @property
+    def watermark(self):
+        """Highest expense id among the materialized sheets"""
+        return self.meta['watermark']
+
+    @property
+    def vocabulary(self):
+        """Category values per column; a value's code is its position and never changes"""
+        return self.meta['vocabulary']
+
+    @property
+    def sheet_fingerprints(self):
+        """Fingerprint recorded for each materialized sheet, by sheet id"""
+        return {int(sheet_id): tuple(entry['fingerprint']) for sheet_id, entry in self.meta['sheets'].items()}
+
+    def sheets_since(self, position):
+        """Number of current sheets whose rows were written at or after a row position"""
+        return sum(1 for entry in self.meta['sheets'].values() if entry['start'] >= position and entry['end'] > entry['start'])
+
+    def live_mask(self):
+        """Boolean mask over row positions of the rows of current sheets"""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for entry in self.meta['sheets'].values():
+            mask[entry['start']:entry['end']] = True
+        return mask
+
+    def _path(self, name, epoch=None):
+        return os.path.join(self.directory, f"{name}.{self.epoch if epoch is None else epoch}.bin")
+
+    def _row_width(self, name):
+        return self.n_features if name == 'features' else 1
+
+    def _truncate_uncommitted(self):
+        for name, dtype in ARRAY_DTYPES.items():
+            path = self._path(name)
+            size = self.n_rows * self._row_width(name) * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    def _remove_stale_epochs(self):
+        # Files of the previous epoch are kept for readers that loaded meta before the
+        # last compaction; newer epochs were left by a compaction that crashed
+        for entry in os.listdir(self.directory):
+            name, _, epoch = entry[:-len('.bin')].rpartition('.') if entry.endswith('.bin') else ('', '', '')
+            if name in ARRAY_DTYPES and epoch.isdigit() and int(epoch) not in (self.epoch, self.epoch - 1):
+                os.unlink(os.path.join(self.directory, entry))
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Serialize writers across processes and start from the latest committed state"""
+        with file_lock(os.path.join(self.directory, LOCK_FILE)):
+            self._load_meta()
+            self._remove_stale_epochs()
+            self._truncate_uncommitted()
+            self._reset_pending()
+            yield self
+
+    def extend_vocabulary(self, column, values):
+        """Append values not seen before to a column's vocabulary"""
+        vocabulary = self.meta['vocabulary'][column]
+        known = set(vocabulary)
+        for value in values:
+            if value not in known:
+                vocabulary.append(value)
+                known.add(value)
+
+    def append(self, sheet_id, fingerprint, features, labels, timestamps, expense_ids):
+        """Write the rows of a sheet, replacing its earlier rows once committed
+
+        ``fingerprint`` identifies the state of the sheet's expenses the rows were built
+        from. A sheet may be appended with no rows to record that it was seen.
+        """
+        columns = {
+            'features': np.asarray(features, dtype=ARRAY_DTYPES['features']).reshape(-1, self.n_features),
+            'labels': np.asarray(labels, dtype=ARRAY_DTYPES['labels']),
+            'timestamps': np.asarray(timestamps, dtype=ARRAY_DTYPES['timestamps']),
+            'expense_ids': np.asarray(expense_ids, dtype=ARRAY_DTYPES['expense_ids'])
+        }
+        n_rows = len(columns['features'])
+        if any(len(array) != n_rows for array in columns.values()):
+            raise ValueError("Feature store columns must have the same number of rows")
+
+        for name, array in columns.items():
+            with open(self._path(name), 'ab') as f:
+                f.write(np.ascontiguousarray(array).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        start = self.n_rows + self._pending_rows
+        self._pending_sheets[str(sheet_id)] = {'start': start, 'end': start + n_rows, 'fingerprint': list(fingerprint)}
+        self._pending_rows += n_rows
+
+    def remove_sheets(self, sheet_ids):
+        """Drop the rows of deleted sheets once committed"""
+        self._pending_removals.update(str(sheet_id) for sheet_id in sheet_ids)
+
+    def commit(self):
+        """Publish appended rows, sheet changes and vocabulary"""
+        sheets = self.meta['sheets']
+        for sheet_id in self._pending_removals:
+            sheets.pop(sheet_id, None)
+        sheets.update(self._pending_sheets)
+        self.meta['n_rows'] += self._pending_rows
+        self.meta['watermark'] = max((entry['fingerprint'][1] for entry in sheets.values() if entry['fingerprint']), default=0)
+        self._reset_pending()
+        self._write_meta()
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.directory, META_FILE)
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, meta_path)
+
+    def compact(self):
+        """Rewrite the live rows into files of the next epoch, dropping dead rows
+
+        Row positions change, so consumers holding positions must check ``epoch``. The
+        previous epoch's files are removed by the next compaction. Must be called with the
+        store locked and nothing pending.
+        """
+        if self._pending_rows or self._pending_sheets or self._pending_removals:
+            raise RuntimeError("Commit pending rows before compacting the feature store")
+        new_epoch = self.epoch + 1
+        entries = sorted(self.meta['sheets'].values(), key=lambda entry: entry['start'])
+
+        for name in ARRAY_DTYPES:
+            source = self.array(name)
+            with open(self._path(name, new_epoch), 'wb') as f:
+                for entry in entries:
+                    f.write(np.ascontiguousarray(source[entry['start']:entry['end']]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            del source
+
+        position = 0
+        for entry in entries:
+            length = entry['end'] - entry['start']
+            entry['start'], entry['end'] = position, position + length
+            position += length
+        self.meta['n_rows'] = position
+        self.meta['epoch'] = new_epoch
+        self._write_meta()
+        self._remove_stale_epochs()
+
+    def array(self, name):
+        """Read-only memory map over the committed rows of a column"""
+        if not self.n_rows:
+            shape = (0, self.n_features) if name == 'features' else (0,)
+            return np.empty(shape, dtype=ARRAY_DTYPES[name])
+        shape = (self.n_rows, self.n_features) if name == 'features' else (self.n_rows,)
+        return np.memmap(self._path(name), dtype=ARRAY_DTYPES[name], mode='r', shape=shape)
+
+    def prune_other_schemas(self):
+        """Remove stores written for feature layouts other than this one"""
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if entry != self.schema and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,262 @@
+import contextlib
+import heapq
+import threading
+import time
+import tracemalloc
+from django.db import connections
+
+# Process-wide totals per stage, served by the timings endpoint
+_aggregate = {}
+_aggregate_lock = threading.Lock()
+
+
+class QueryCounter:
+    """connection.execute_wrapper hook counting statements and their time
+
+    Install it with ``count_queries`` to see the statements of every database alias.
+
+    With ``keep_slowest`` it also keeps that many of the slowest statements (SQL without
+    parameters) as ``(seconds, sql)`` pairs, slowest first in ``slowest()``.
+    """
+
+    def __init__(self, keep_slowest=0):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_slowest = keep_slowest
+        self._slowest = []  # Min-heap of (seconds, sql)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.seconds += elapsed
+            if self.keep_slowest:
+                if len(self._slowest) < self.keep_slowest:
+                    heapq.heappush(self._slowest, (elapsed, sql))
+                elif elapsed > self._slowest[0][0]:
+                    heapq.heapreplace(self._slowest, (elapsed, sql))
+
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+
+@contextlib.contextmanager
+def count_queries(counter):
+    """Install ``counter`` on the connection of every database alias (primary and replica)"""
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+        yield counter
+
+
+class Instrumentation:
+    """Wall time, thread CPU time, rows and database queries per named stage
+
+    Stage names are dotted by operation (``analyze_sheet.encode``). Stages may nest (an
+    outer stage includes its inner ones) and may run in worker threads; CPU time is
+    measured per thread and queries on the calling thread's connections to every database
+    alias. Every finished
+    stage is also added to the process-wide aggregate.
+
+    With ``memory=True`` every stage is also traced with tracemalloc (see
+    ``MemoryProfiler``); the results are kept apart from the timings in ``memory_dict()``.
+    """
+
+    def __init__(self, memory=False, memory_top=10):
+        self.stages = {}
+        self._lock = threading.Lock()
+        self.memory = MemoryProfiler(top=memory_top) if memory else None
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """Time a block; the yielded dict accepts ``rows`` when only known afterwards"""
+        record = {'rows': rows}
+        queries = QueryCounter()
+        memory = self.memory.stage(name) if self.memory is not None else contextlib.nullcontext()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            with count_queries(queries), memory:
+                yield record
+        finally:
+            self._add(name, {
+                'wall_seconds': time.perf_counter() - wall_start,
+                'cpu_seconds': time.thread_time() - cpu_start,
+                'rows': int(record['rows'] or 0),
+                'queries': queries.count,
+                'query_seconds': queries.seconds
+            })
+
+    def _add(self, name, sample):
+        with self._lock:
+            _merge(self.stages, name, sample)
+        with _aggregate_lock:
+            _merge(_aggregate, name, sample)
+
+    def as_dict(self):
+        with self._lock:
+            return {name: _summarize(totals) for name, totals in self.stages.items()}
+
+    def memory_dict(self):
+        return self.memory.as_dict() if self.memory is not None else {}
+
+
+# Open memory stages of every thread and profiler. tracemalloc has one process-wide peak,
+# so it is only reset after that peak has been folded into every open stage.
+_memory_lock = threading.Lock()
+_open_memory_frames = []
+_memory_tracing = {'users': 0, 'started': False}
+
+
+class MemoryProfiler:
+    """Peak and retained Python heap bytes per stage, with the top allocation sites
+
+    Starts tracemalloc with the first open stage of the process if it is not already
+    tracing, and stops it when the last one ends. ``peak_bytes`` is the highest traced
+    memory reached during a stage above what was allocated when it started, including
+    nested stages; ``retained_bytes`` is what was still allocated when it ended.
+    tracemalloc is process-wide: stages running concurrently in other threads are
+    counted in each other's peaks. Allocation sites come from snapshots taken around the
+    stage, so only stages that are not nested in another are snapshotted to keep the
+    overhead bounded.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        frames = self._local.__dict__.setdefault('frames', [])
+        _acquire_tracing()
+        try:
+            # Snapshot before the stage starts so the snapshot itself is not measured
+            snapshot = _snapshot() if not frames and self.top else None
+            frame = _open_memory_frame()
+            frames.append(frame)
+            try:
+                yield
+            finally:
+                frames.pop()
+                current = _close_memory_frame(frame)
+            sample = {
+                'peak_bytes': max(frame['peak'] - frame['start'], 0),
+                'retained_bytes': current - frame['start'],
+                'top_allocations': _top_allocations(snapshot, _snapshot(), self.top) if snapshot else None,
+            }
+        finally:
+            _release_tracing()
+        self._add(name, sample)
+
+    def _add(self, name, sample):
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = {'calls': 0, 'peak_bytes': 0, 'retained_bytes': 0, 'top_allocations': None}
+            totals['calls'] += 1
+            totals['peak_bytes'] = max(totals['peak_bytes'], sample['peak_bytes'])
+            totals['retained_bytes'] += sample['retained_bytes']
+            if sample['top_allocations'] is not None:
+                totals['top_allocations'] = sample['top_allocations']
+
+    def as_dict(self):
+        """Per stage: calls, largest peak, total retained bytes and the latest allocation sites"""
+        with self._lock:
+            return {name: dict(totals) for name, totals in self.stages.items()}
+
+
+def _acquire_tracing():
+    """Start tracemalloc for the first open stage of the process unless already tracing"""
+    with _memory_lock:
+        if not _memory_tracing['users'] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memory_tracing['started'] = True
+        _memory_tracing['users'] += 1
+
+
+def _release_tracing():
+    """Stop tracemalloc after the last stage, if a stage started it"""
+    with _memory_lock:
+        _memory_tracing['users'] -= 1
+        if not _memory_tracing['users'] and _memory_tracing['started']:
+            tracemalloc.stop()
+            _memory_tracing['started'] = False
+
+
+def _open_memory_frame():
+    with _memory_lock:
+        current = _fold_peak()
+        frame = {'start': current, 'peak': current}
+        _open_memory_frames.append(frame)
+        return frame
+
+
+def _close_memory_frame(frame):
+    """Finish a frame's peak and return the traced memory when it ended"""
+    with _memory_lock:
+        current = _fold_peak()
+        # By identity: frames of different stages can hold equal numbers
+        _open_memory_frames[:] = [open_frame for open_frame in _open_memory_frames if open_frame is not frame]
+        return current
+
+
+def _fold_peak():
+    """Add the peak since the last reset to every open frame, then reset it"""
+    current, peak = tracemalloc.get_traced_memory()
+    for frame in _open_memory_frames:
+        frame['peak'] = max(frame['peak'], peak)
+    tracemalloc.reset_peak()
+    return current
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+
+def _top_allocations(before, after, top):
+    """Source lines that grew the most between two snapshots"""
+    return [
+        {
+            'site': f'{diff.traceback[0].filename}:{diff.traceback[0].lineno}',
+            'size_bytes': diff.size_diff,
+            'count': diff.count_diff,
+        }
+        for diff in after.compare_to(before, 'lineno')[:top]
+        if diff.size_diff > 0
+    ]
+
+
+def _merge(stages, name, sample):
+    totals = stages.get(name)
+    if totals is None:
+        totals = stages[name] = {'calls': 0, 'max_wall_seconds': 0.0}
+    totals['calls'] += 1
+    totals['max_wall_seconds'] = max(totals['max_wall_seconds'], sample['wall_seconds'])
+    for key, value in sample.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def _summarize(totals):
+    summary = dict(totals)
+    summary['rows_per_second'] = totals['rows'] / totals['wall_seconds'] if totals['wall_seconds'] > 0 else None
+    return summary
+
+
+def aggregate_timings():
+    """Snapshot of every stage recorded in this process"""
+    with _aggregate_lock:
+        return {name: _summarize(totals) for name, totals in _aggregate.items()}
+
+
+def reset_aggregate_timings():
+    with _aggregate_lock:
+        _aggregate.clear()
@@ -0,0 +1,35 @@
+import importlib
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access
+
+    Keeps pandas, scikit-learn and xgboost out of process startup for code paths
+    (most views, management commands) that never touch the ML stack.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<LazyModule '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """Return a proxy for ``name`` that defers the import until first use"""
+    return LazyModule(name)
@@ -0,0 +1,21 @@
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows; single-writer deployments only
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on ``path`` shared by every process on the host"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
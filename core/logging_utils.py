@@ -0,0 +1,122 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import weakref
+from datetime import datetime, timezone
+from . import metrics
+
+# LogRecord attributes that are not caller-supplied ``extra`` fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, its context and any ``extra`` fields"""
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of high-volume records
+
+    Attach it to the logger of per-row events (not to a handler, which would sample
+    every logger). Applies to records at or below ``max_level``; everything more severe
+    always passes. Kept records carry ``sample_rate`` so counts can be scaled back up.
+    """
+
+    def __init__(self, rate=0.01, max_level='DEBUG'):
+        super().__init__()
+        self.rate = float(rate)
+        self.max_level = logging.getLevelName(max_level) if isinstance(max_level, str) else max_level
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        if self.rate >= 1.0:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+# Live AsyncQueueHandlers, whose listener threads do not survive a fork
+_async_handlers = weakref.WeakSet()
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to a background thread that does the actual I/O
+
+    Records are formatted on the calling thread and put on a bounded queue without
+    blocking; when the writer falls behind, records are dropped and counted (``dropped``
+    and the analytics_log_records_dropped_total metric) instead of stalling request
+    handling. The writer thread emits to stderr, or to ``filename`` when given, is
+    restarted in forked worker processes and is flushed at interpreter exit.
+    """
+
+    def __init__(self, filename=None, max_queue_size=10000):
+        super().__init__(queue.Queue(maxsize=max_queue_size))
+        self.dropped = 0
+        if filename:
+            target = logging.FileHandler(filename, encoding='utf-8')
+        else:
+            target = logging.StreamHandler(sys.stderr)
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.stop)
+        _async_handlers.add(self)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.record_log_dropped()
+
+    def stop(self):
+        """Write out every queued record and stop the writer thread; safe to call twice"""
+        if self.listener._thread is None:
+            return
+        # Blocks for room instead of failing when the queue is full at shutdown
+        self.queue.put(self.listener._sentinel)
+        self.listener._thread.join()
+        self.listener._thread = None
+
+    def _restart_listener(self):
+        """Give a forked child its own queue and writer thread
+
+        Only the forking thread survives a fork, so the inherited listener would never
+        drain the queue. Records the parent had queued stay with the parent.
+        """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener.queue = self.queue
+        self.listener._thread = None
+        self.listener.start()
+
+
+def _restart_listeners_after_fork():
+    for handler in list(_async_handlers):
+        handler._restart_listener()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Pre-forking servers (gunicorn) configure logging in the master before forking workers
+    os.register_at_fork(after_in_child=_restart_listeners_after_fork)
@@ -21,9 +21,14 @@ class Command(BaseCommand):
             type=int,
             help='Analyze specific sheet by ID',
         )
+        parser.add_argument(
+            '--memory-profile',
+            action='store_true',
+            help='Trace memory with tracemalloc and report peak/retained bytes and top allocation sites per stage',
+        )
 
     def handle(self, *args, **options):
-        analyzer = ExpenseSheetAnalyzer()
+        analyzer = ExpenseSheetAnalyzer(memory_profile=options['memory_profile'])
         
         if options['train']:
             self.stdout.write('Training models...')
@@ -93,9 +98,26 @@ class Command(BaseCommand):
                     self.style.ERROR(f'Error: {e}')
                 )
         
+        if options['memory_profile']:
+            self._write_memory_report(analyzer.instrumentation.memory_dict())
+        
         if not any([options['train'], options['analyze_all'], options['sheet_id']]):
             self.stdout.write('No action specified. Use --help for options.')
             self.stdout.write('Available options:')
             self.stdout.write('  --train        Train models on existing data')
             self.stdout.write('  --analyze-all   Analyze all expense sheets')
-            self.stdout.write('  --sheet-id ID   Analyze specific sheet by ID') 
\ No newline at end of file
+            self.stdout.write('  --sheet-id ID   Analyze specific sheet by ID') 
+    
+    def _write_memory_report(self, report):
+        self.stdout.write('Memory profile (tracemalloc):')
+        for name, stage in sorted(report.items(), key=lambda item: item[1]['peak_bytes'], reverse=True):
+            self.stdout.write(
+                f'  {name}: peak {_mib(stage["peak_bytes"])}, retained {_mib(stage["retained_bytes"])} '
+                f'over {stage["calls"]} call(s)'
+            )
+            for site in stage['top_allocations'] or []:
+                self.stdout.write(f'      {_mib(site["size_bytes"])} in {site["count"]} blocks at {site["site"]}')
+
+
+def _mib(n_bytes):
+    return f'{n_bytes / 2 ** 20:.2f} MiB'
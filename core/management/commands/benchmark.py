@@ -0,0 +1,285 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+STAGES = [
+    'ingest', 'prepare_sheet_data', 'add_features', 'train_models', 'calculate_advanced_metrics',
+    'run_anomaly_detection', 'save_expense_analyses'
+]
+
+# Raw columns of a prepared sheet frame, before _add_features
+RAW_COLUMNS = [
+    'id', 'date', 'category', 'subcategory', 'description', 'employee', 'department', 'amount',
+    'currency', 'payment_method', 'vendor_supplier', 'receipt_number', 'status', 'approved_by', 'notes'
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time ingestion, feature engineering, training, scoring and persistence on synthetic sheets '
+        'in a throwaway in-process database and write the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,100000',
+            help='Comma-separated sheet sizes in rows (default: 1000,10000,100000; up to 1000000)',
+        )
+        parser.add_argument(
+            '--stages',
+            default=','.join(STAGES),
+            help=f'Comma-separated stages to run (default: all of {",".join(STAGES)})',
+        )
+        parser.add_argument(
+            '--training-rows',
+            type=int,
+            default=20000,
+            help='Rows of history, spread over 4 sheets, the models are trained on (default: 20000)',
+        )
+        parser.add_argument(
+            '--ingest-max-rows',
+            type=int,
+            default=100000,
+            help='Skip the upload stage for larger sizes; it saves row by row (default: 100000)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic data (default: 0)')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.2,
+            help='Relative slowdown against the baseline reported as a regression (default: 0.2)',
+        )
+        parser.add_argument(
+            '--min-seconds',
+            type=float,
+            default=0.05,
+            help='Stages faster than this in the baseline are compared but never flagged (default: 0.05)',
+        )
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='Exit with an error when any stage regressed beyond the tolerance',
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = sorted(set(stages) - set(STAGES))
+        if unknown:
+            raise CommandError(f'Unknown stages: {", ".join(unknown)}')
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        model_dir = tempfile.mkdtemp(prefix='analytics-benchmark-')
+        old_name = connection.settings_dict['NAME']
+        # DEBUG would keep every statement in connection.queries
+        with override_settings(DEBUG=False, ANALYTICS_MODEL_DIR=model_dir):
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results = self._run(sizes, stages, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                shutil.rmtree(model_dir, ignore_errors=True)
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'environment': _environment(),
+            'config': {
+                'sizes': sizes,
+                'stages': stages,
+                'training_rows': options['training_rows'],
+                'seed': options['seed'],
+            },
+            'results': results,
+        }
+        if baseline is not None:
+            report['comparison'] = compare(baseline, report, options['tolerance'], options['min_seconds'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = report['comparison']['regressions']
+            for regression in regressions:
+                self.stderr.write(
+                    f"Regression: {regression['stage']} at {regression['size']} rows "
+                    f"{regression['baseline_seconds']:.3f}s -> {regression['seconds']:.3f}s"
+                )
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} stage(s) regressed beyond the tolerance')
+
+    def _run(self, sizes, stages, options):
+        from core import synthetic
+        from core.analytics import ExpenseSheetAnalyzer
+        from core.instrumentation import Instrumentation
+
+        seed = options['seed']
+        sheet_day = date(2024, 1, 1)
+
+        # History the models are trained on, shared by every size
+        history_rows = options['training_rows'] // 4
+        for i in range(4):
+            synthetic.create_sheet(
+                f'benchmark-history-{i}', synthetic.expense_frame(history_rows, seed=seed + i),
+                sheet_date=sheet_day + timedelta(days=i)
+            )
+
+        results = {}
+        for size_index, size in enumerate(sizes):
+            self.stderr.write(f'Benchmarking {size} rows...')
+            instrumentation = Instrumentation()
+            stage = instrumentation.stage
+            frame = synthetic.expense_frame(size, seed=seed + 100 + size_index)
+            analyzer = ExpenseSheetAnalyzer()
+            skipped = []
+            upload_timings = {}
+
+            if 'ingest' in stages:
+                if size <= options['ingest_max_rows']:
+                    csv_text = synthetic.upload_csv(frame)
+                    with stage('ingest', rows=size):
+                        upload_timings = self._upload(csv_text, f'benchmark-upload-{size}')
+                else:
+                    skipped.append('ingest')
+
+            sheet = synthetic.create_sheet(f'benchmark-{size}', frame, sheet_date=sheet_day + timedelta(days=30 + size_index))
+
+            if 'train_models' in stages:
+                # Trains on every sheet in the database, so report the rows actually sampled
+                with stage('train_models') as training:
+                    analyzer.train_models()
+                    training['rows'] = analyzer.instrumentation.as_dict().get('train_models.sample', {}).get('rows')
+            else:
+                analyzer.load_models()
+
+            with stage('prepare_sheet_data', rows=size):
+                df = analyzer.prepare_sheet_data(sheet)
+            if 'add_features' in stages:
+                raw = df[RAW_COLUMNS].copy()
+                with stage('add_features', rows=size):
+                    analyzer._add_features(raw)
+
+            X = analyzer.preprocessor.transform(df) if analyzer.preprocessor.fitted else None
+            if 'run_anomaly_detection' in stages or 'save_expense_analyses' in stages:
+                if X is None:
+                    raise CommandError('Models are not trained; include the train_models stage')
+                with stage('run_anomaly_detection', rows=size):
+                    anomaly_results = analyzer._run_anomaly_detection(X, df)
+
+            if 'calculate_advanced_metrics' in stages or 'save_expense_analyses' in stages:
+                with stage('calculate_advanced_metrics', rows=size):
+                    advanced_metrics = analyzer.calculate_advanced_metrics(df, sheet)
+
+            if 'save_expense_analyses' in stages:
+                sheet_metrics = analyzer._calculate_sheet_metrics(df, anomaly_results, advanced_metrics)
+                sheet_analysis = analyzer._save_sheet_analysis(sheet, sheet_metrics, anomaly_results)
+                with stage('save_expense_analyses', rows=size):
+                    analyzer._save_expense_analyses(sheet, df, anomaly_results, sheet_analysis)
+                with stage('save_expense_analyses.update', rows=size):
+                    analyzer._save_expense_analyses(sheet, df, anomaly_results, sheet_analysis)
+
+            timings = instrumentation.as_dict()
+            results[str(size)] = {
+                name: {
+                    'seconds': timing['wall_seconds'],
+                    'cpu_seconds': timing['cpu_seconds'],
+                    'rows': timing['rows'],
+                    'rows_per_second': timing['rows_per_second'],
+                    'queries': timing['queries'],
+                }
+                for name, timing in timings.items()
+                if name.split('.')[0] in stages
+            }
+            # The upload view auto-trains a fresh analyzer, which is not ingestion cost:
+            # report it on its own and take it out of the ingest stage
+            if 'train_models.total' in upload_timings and 'ingest' in results[str(size)]:
+                training = upload_timings['train_models.total']
+                ingest = results[str(size)]['ingest']
+                ingest['seconds'] = max(ingest['seconds'] - training['wall_seconds'], 0.0)
+                ingest['cpu_seconds'] = max(ingest['cpu_seconds'] - training['cpu_seconds'], 0.0)
+                ingest['queries'] -= training['queries']
+                ingest['rows_per_second'] = ingest['rows'] / ingest['seconds'] if ingest['seconds'] > 0 else None
+                results[str(size)]['ingest.auto_train'] = {
+                    'seconds': training['wall_seconds'],
+                    'cpu_seconds': training['cpu_seconds'],
+                    'rows': training['rows'],
+                    'rows_per_second': None,
+                    'queries': training['queries'],
+                }
+            if skipped:
+                results[str(size)]['skipped'] = skipped
+        return results
+
+    def _upload(self, csv_text, sheet_name):
+        from core.views import ExpenseUploadView
+
+        request = APIRequestFactory().post(
+            '/api/expenses/upload/?timings=1',
+            {'file': SimpleUploadedFile(f'{sheet_name}.csv', csv_text.encode('utf-8'), content_type='text/csv')},
+            format='multipart'
+        )
+        response = ExpenseUploadView.as_view()(request)
+        if response.status_code != 201:
+            raise CommandError(f'Upload failed with status {response.status_code}: {response.data}')
+        return response.data.get('_timings', {})
+
+
+def compare(baseline, current, tolerance, min_seconds=0.0):
+    """Per size and stage: baseline and current seconds, their ratio and the regressions"""
+    stages = {}
+    regressions = []
+    for size, timings in current['results'].items():
+        baseline_timings = baseline.get('results', {}).get(size, {})
+        for name, timing in timings.items():
+            if name == 'skipped' or name not in baseline_timings:
+                continue
+            before = baseline_timings[name]['seconds']
+            ratio = timing['seconds'] / before if before > 0 else None
+            entry = {'baseline_seconds': before, 'seconds': timing['seconds'], 'ratio': ratio}
+            stages.setdefault(size, {})[name] = entry
+            if ratio is not None and ratio > 1 + tolerance and before >= min_seconds:
+                regressions.append({'size': int(size), 'stage': name, **entry})
+    return {
+        'baseline_created_at': baseline.get('created_at'),
+        'tolerance': tolerance,
+        'stages': stages,
+        'regressions': regressions,
+    }
+
+
+def _environment():
+    from importlib import metadata
+
+    versions = {}
+    for package in ('django', 'numpy', 'pandas', 'scikit-learn', 'xgboost'):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'database': connection.vendor,
+        'packages': versions,
+    }
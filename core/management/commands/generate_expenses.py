@@ -0,0 +1,132 @@
+import json
+import os
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from core.models import ExpenseSheet
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic expense sheets with planted fraud patterns, as upload-ready CSV files '
+        'or inserted straight into the database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sheets', type=int, default=1, help='Number of sheets (default: 1)')
+        parser.add_argument('--rows', type=int, default=1000, help='Expenses per sheet (default: 1000)')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'db'],
+            default='csv',
+            help='Write CSV files in the upload format, or insert rows in bulk into the database (default: csv)',
+        )
+        parser.add_argument('--output-dir', default='generated_expenses', help='Directory for CSV files')
+        parser.add_argument('--sheet-prefix', default='synthetic', help='Sheet name prefix (default: synthetic)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500000,
+            help='Rows generated and written at a time, bounding memory (default: 500000)',
+        )
+
+        distribution = parser.add_argument_group('distributions')
+        distribution.add_argument('--employees', type=int, help='Distinct employees (default: 200)')
+        distribution.add_argument('--vendors', type=int, help='Distinct vendors (default: 500)')
+        distribution.add_argument('--approvers', type=int, help='Distinct approvers (default: 20)')
+        distribution.add_argument('--departments', help='Comma-separated department names')
+        distribution.add_argument('--vendor-skew', type=float, help='Zipf exponent of vendor popularity, 0 for uniform (default: 1.2)')
+        distribution.add_argument('--amount-scale', type=float, help='Multiplier applied to all amounts (default: 1.0)')
+        distribution.add_argument('--start-date', type=date.fromisoformat, help='First expense date, YYYY-MM-DD (default: 2024-01-01)')
+        distribution.add_argument('--days', type=int, help='Days spanned by each sheet (default: 90)')
+        distribution.add_argument(
+            '--profile',
+            help='JSON file overriding any distribution setting, e.g. categories or payment_methods weights',
+        )
+
+        fraud = parser.add_argument_group('fraud patterns (share of rows)')
+        fraud.add_argument('--duplicate-rate', type=float, help='Resubmitted duplicates (default: 0.01)')
+        fraud.add_argument('--round-amount-rate', type=float, help='Inflated round amounts (default: 0.01)')
+        fraud.add_argument('--weekend-rate', type=float, help='Weekend spend (default: 0.01)')
+        fraud.add_argument('--manifest', help='Write a JSON manifest with the receipt numbers of every planted row')
+
+    def handle(self, *args, **options):
+        from core import synthetic
+
+        profile = self._profile(options)
+        rates = {
+            name: options[f'{name}_rate'] for name in synthetic.FRAUD_RATES if options[f'{name}_rate'] is not None
+        }
+        if options['rows'] < 1 or options['sheets'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--sheets, --rows and --chunk-size must be positive')
+        if options['format'] == 'csv':
+            os.makedirs(options['output_dir'], exist_ok=True)
+
+        start = time.perf_counter()
+        manifest = []
+        for index in range(options['sheets']):
+            sheet_name = f"{options['sheet_prefix']}_{index + 1:04d}"
+            manifest.append(self._generate_sheet(synthetic, index, sheet_name, profile, rates, options))
+            self.stdout.write(f"{sheet_name}: {options['rows']} rows ({manifest[-1]['fraud']})")
+
+        elapsed = time.perf_counter() - start
+        total_rows = options['sheets'] * options['rows']
+        if options['manifest']:
+            with open(options['manifest'], 'w') as f:
+                json.dump({
+                    'seed': options['seed'],
+                    'rates': {**synthetic.FRAUD_RATES, **rates},
+                    'profile': profile,
+                    'sheets': manifest,
+                }, f, indent=2, default=str)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {total_rows} expenses in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s)'
+        ))
+
+    def _profile(self, options):
+        profile = {}
+        if options['profile']:
+            with open(options['profile']) as f:
+                profile.update(json.load(f))
+            if 'start_date' in profile:
+                profile['start_date'] = date.fromisoformat(profile['start_date'])
+        for key in ('employees', 'vendors', 'approvers', 'vendor_skew', 'amount_scale', 'start_date', 'days'):
+            if options[key] is not None:
+                profile[key] = options[key]
+        if options['departments']:
+            profile['departments'] = [name.strip() for name in options['departments'].split(',') if name.strip()]
+        return profile
+
+    def _generate_sheet(self, synthetic, index, sheet_name, profile, rates, options):
+        sheet_date = (profile.get('start_date') or synthetic.DEFAULT_PROFILE['start_date']) + timedelta(days=index)
+        entry = {'sheet_name': sheet_name, 'rows': options['rows'], 'fraud': {}, 'fraud_receipts': {}}
+
+        if options['format'] == 'db':
+            if ExpenseSheet.objects.filter(sheet_name=sheet_name, sheet_date=sheet_date).exists():
+                raise CommandError(f'Sheet {sheet_name} ({sheet_date}) already exists; use another --sheet-prefix')
+            expense_sheet = ExpenseSheet.objects.create(sheet_name=sheet_name, sheet_date=sheet_date)
+            entry['sheet_id'] = expense_sheet.id
+        else:
+            entry['file'] = os.path.join(options['output_dir'], f'{sheet_name}.csv')
+
+        for chunk, offset in enumerate(range(0, options['rows'], options['chunk_size'])):
+            n_rows = min(options['chunk_size'], options['rows'] - offset)
+            seed = [options['seed'], index, chunk]
+            frame = synthetic.expense_frame(
+                n_rows, profile=profile, seed=seed, receipt_offset=index * options['rows'] + offset
+            )
+            patterns = synthetic.inject_fraud(frame, rates, seed=seed + [1])
+
+            for name in synthetic.FRAUD_RATES:
+                planted = frame['receipt_number'].to_numpy()[patterns == name]
+                entry['fraud'][name] = entry['fraud'].get(name, 0) + len(planted)
+                if options['manifest']:
+                    entry['fraud_receipts'].setdefault(name, []).extend(planted.tolist())
+
+            if options['format'] == 'db':
+                synthetic.insert_expenses(expense_sheet, frame)
+            else:
+                with open(entry['file'], 'w' if chunk == 0 else 'a', newline='') as f:
+                    f.write(synthetic.upload_csv(frame, header=chunk == 0))
+        return entry
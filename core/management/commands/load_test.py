@@ -0,0 +1,202 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from core.stats import percentile
+
+# Operation -> (method, path); {sheet_id} is filled with a random existing sheet
+OPERATIONS = {
+    'upload': ('POST', '/api/expenses/upload/'),
+    'analyze': ('POST', '/api/sheets/{sheet_id}/analyze/'),
+    'list': ('GET', '/api/expenses/'),
+    'bulk': ('POST', '/api/analysis/bulk/'),
+}
+
+DEFAULT_MIX = 'upload=1,analyze=3,list=5,bulk=1'
+
+
+def summarize(samples, elapsed):
+    """Throughput, error rate and latency percentiles (ms) of (status, seconds) samples"""
+    latencies = sorted(seconds * 1000 for _, seconds in samples)
+    errors = sum(1 for status, _ in samples if status is None or status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'throughput_rps': len(samples) / elapsed if elapsed > 0 else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+        'status_codes': dict(Counter(str(status) if status is not None else 'error' for status, _ in samples)),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a running server with concurrent clients issuing a weighted mix of uploads, analyses, '
+        'list calls and bulk analyses, then report throughput, latency percentiles and error rates'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server to test (default: http://127.0.0.1:8000)')
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent clients (default: 4)')
+        parser.add_argument('--duration', type=float, default=60.0, help='Seconds to run (default: 60)')
+        parser.add_argument('--requests', type=int, help='Stop after this many requests in total instead of --duration')
+        parser.add_argument(
+            '--mix',
+            default=DEFAULT_MIX,
+            help=f'Relative weights of {", ".join(OPERATIONS)} (default: {DEFAULT_MIX})',
+        )
+        parser.add_argument('--upload-rows', type=int, default=500, help='Expenses per uploaded sheet (default: 500)')
+        parser.add_argument('--timeout', type=float, default=300.0, help='Per-request timeout in seconds (default: 300)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the operation sequence (default: 0)')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        mix = self._parse_mix(options['mix'])
+        if options['clients'] < 1:
+            raise CommandError('--clients must be positive')
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.run_id = uuid.uuid4().hex[:8]
+
+        sheet_ids = self._sheet_ids()
+        if mix.get('analyze') and not sheet_ids:
+            raise CommandError('The analyze operation needs existing sheets; upload some first or drop it from --mix')
+        upload_csv = self._upload_csv(options['upload_rows'], options['seed']) if mix.get('upload') else None
+
+        samples = {name: [] for name in mix}
+        remaining = [options['requests']] if options['requests'] else None
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def next_request():
+            if remaining is None:
+                return time.perf_counter() < deadline
+            with lock:
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+
+        def client(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            names, weights = zip(*mix.items())
+            sequence = 0
+            while next_request():
+                name = rng.choices(names, weights)[0]
+                sequence += 1
+                status, seconds = self._request(name, rng, sheet_ids, upload_csv, f'{index}-{sequence}')
+                samples[name].append((status, seconds))
+
+        self.stdout.write(
+            f"Load testing {self.base_url} with {options['clients']} clients "
+            f"({'%d requests' % options['requests'] if options['requests'] else '%.0fs' % options['duration']})..."
+        )
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(options['clients'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'base_url': self.base_url,
+            'clients': options['clients'],
+            'mix': mix,
+            'elapsed_seconds': elapsed,
+            'overall': summarize([sample for values in samples.values() for sample in values], elapsed),
+            'endpoints': {name: summarize(values, elapsed) for name, values in samples.items()},
+        }
+        self._write_table(report)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def _parse_mix(self, value):
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            name = name.strip()
+            if not name:
+                continue
+            if name not in OPERATIONS:
+                raise CommandError(f'Unknown operation in --mix: {name} (choose from {", ".join(OPERATIONS)})')
+            try:
+                mix[name] = float(weight) if weight else 1.0
+            except ValueError:
+                raise CommandError(f'Invalid weight for {name}: {weight}')
+        mix = {name: weight for name, weight in mix.items() if weight > 0}
+        if not mix:
+            raise CommandError('--mix selects no operations')
+        return mix
+
+    def _sheet_ids(self):
+        status, body = self._send('GET', OPERATIONS['list'][1])
+        if status != 200:
+            raise CommandError(f'Could not list sheets from {self.base_url} (status {status})')
+        return [sheet['id'] for sheet in json.loads(body)]
+
+    def _upload_csv(self, rows, seed):
+        from core import synthetic
+
+        frame = synthetic.expense_frame(rows, seed=seed)
+        synthetic.inject_fraud(frame, seed=seed)
+        return synthetic.upload_csv(frame).encode('utf-8')
+
+    def _request(self, name, rng, sheet_ids, upload_csv, request_id):
+        method, path = OPERATIONS[name]
+        body = None
+        headers = {'X-Request-ID': f'loadtest-{self.run_id}-{request_id}'}
+        if name == 'analyze':
+            path = path.format(sheet_id=rng.choice(sheet_ids))
+        elif name == 'upload':
+            # Unique sheet names so every upload creates a sheet instead of appending to one
+            boundary = uuid.uuid4().hex
+            filename = f'loadtest-{self.run_id}-{request_id}.csv'
+            body = b''.join([
+                f'--{boundary}\r\n'.encode(),
+                f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+                b'Content-Type: text/csv\r\n\r\n',
+                upload_csv,
+                f'\r\n--{boundary}--\r\n'.encode(),
+            ])
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+
+        start = time.perf_counter()
+        status, _ = self._send(method, path, body, headers)
+        return status, time.perf_counter() - start
+
+    def _send(self, method, path, body=None, headers=None):
+        """(status or None on connection errors, body) of one request"""
+        request = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return None, b''
+
+    def _write_table(self, report):
+        self.stdout.write(f"{'endpoint':<10} {'requests':>8} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        rows = list(report['endpoints'].items()) + [('overall', report['overall'])]
+        for name, stats in rows:
+            self.stdout.write(
+                f"{name:<10} {stats['requests']:>8} {stats['errors']:>7} {stats['throughput_rps'] or 0:>8.2f} "
+                f"{_ms(stats['p50_ms'])} {_ms(stats['p95_ms'])} {_ms(stats['p99_ms'])}"
+            )
+
+
+def _ms(value):
+    return f'{value:>9.1f}' if value is not None else f"{'-':>9}"
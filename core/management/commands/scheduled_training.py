@@ -52,7 +52,10 @@ class Command(BaseCommand):
             self.stdout.write('No new data sufficient for retraining')
             self.stdout.write(f'Threshold: {analyzer.training_config["auto_train_threshold"]} sheets')
         
-        # Check model performance
+        # Check model performance from the drift counters kept during analysis
+        report = analyzer.drift_report()
+        if report is not None:
+            self.stdout.write(f'Drift: max PSI {report["max_psi"]:.3f} over {report["rows"]} analyzed rows')
         if analyzer.evaluate_model_performance():
             self.stdout.write('Performance check suggests retraining...')
             success = analyzer.train_models()
@@ -0,0 +1,267 @@
+import contextlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.utils import ConnectionHandler
+from django.test.utils import override_settings
+from core.db import pragma_statements
+from core.stats import percentile
+
+SCHEMA = [
+    'CREATE TABLE expense (id INTEGER PRIMARY KEY, sheet_id INTEGER NOT NULL, date TEXT, employee TEXT, '
+    'vendor TEXT, amount REAL, fraud_score REAL NOT NULL DEFAULT 0)',
+    'CREATE INDEX expense_sheet ON expense (sheet_id)',
+    'CREATE INDEX expense_score ON expense (fraud_score)',
+]
+
+INSERT = 'INSERT INTO expense (sheet_id, date, employee, vendor, amount) VALUES (%s, %s, %s, %s, %s)'
+
+# Rewrites the fraud scores of a batch, as saving the analysis of a sheet does
+RESCORE = (
+    'UPDATE expense SET fraud_score = abs(random() %% 1000) / 1000.0 '
+    'WHERE id IN (SELECT id FROM expense WHERE sheet_id = %s LIMIT %s)'
+)
+
+# Queries behind the dashboard list and the flagged-expenses view
+READS = [
+    'SELECT sheet_id, COUNT(*), SUM(amount), MAX(fraud_score) FROM expense WHERE sheet_id = %s GROUP BY sheet_id',
+    'SELECT id, employee, vendor, amount, fraud_score FROM expense WHERE sheet_id = %s AND fraud_score > 0 '
+    'ORDER BY fraud_score DESC LIMIT 50',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure concurrent read/write throughput of SQLite through Django connections, once with '
+        'SQLite and Django defaults and once with the configured OPTIONS (transaction_mode) and '
+        'ANALYTICS_SQLITE_PRAGMAS, using writer threads saving analysis batches while readers query'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Reader threads (default: 4)')
+        parser.add_argument('--writers', type=int, default=2, help='Writer threads (default: 2)')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per configuration (default: 10)')
+        parser.add_argument('--sheets', type=int, default=20, help='Sheets in the seeded database (default: 20)')
+        parser.add_argument('--rows', type=int, default=100000, help='Expenses in the seeded database (default: 100000)')
+        parser.add_argument(
+            '--batch-rows',
+            type=int,
+            default=2000,
+            help='Rows inserted and rescored per write transaction (default: 2000)',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=5.0,
+            help="Seconds the driver waits for a lock, as Django's default (default: 5)",
+        )
+        parser.add_argument('--directory', help='Where to create the scratch databases (default: a temp directory)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if min(options['readers'], options['writers'], options['sheets'], options['rows'], options['batch_rows']) < 1:
+            raise CommandError('--readers, --writers, --sheets, --rows and --batch-rows must be positive')
+        default_db = settings.DATABASES[DEFAULT_DB_ALIAS]
+        if not default_db['ENGINE'].endswith('sqlite3'):
+            raise CommandError('sqlite_concurrency measures SQLite; the default database uses another engine')
+        pragmas = getattr(settings, 'ANALYTICS_SQLITE_PRAGMAS', None) or {}
+        try:
+            pragma_statements(pragmas)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        tuned_options = {**default_db.get('OPTIONS', {}), 'timeout': options['timeout']}
+        # name -> (database OPTIONS, pragmas the connection_created receiver applies)
+        configurations = {
+            'default': ({'timeout': options['timeout']}, {}),
+            'tuned': (tuned_options, pragmas),
+        }
+        directory = options['directory'] or tempfile.mkdtemp(prefix='analytics-sqlite-')
+        os.makedirs(directory, exist_ok=True)
+        results = {}
+        try:
+            for name, (db_options, config_pragmas) in configurations.items():
+                path = os.path.join(directory, f'concurrency-{name}.sqlite3')
+                if os.path.exists(path):
+                    os.remove(path)
+                with override_settings(ANALYTICS_SQLITE_PRAGMAS=config_pragmas), _scratch_database(path, db_options) as alias:
+                    self._seed(alias, options)
+                    self.stderr.write(f"Running {name} for {options['duration']:.0f}s...")
+                    results[name] = self._run(alias, options)
+                    results[name]['journal_mode'] = self._journal_mode(alias)
+                    results[name]['transaction_mode'] = db_options.get('transaction_mode') or 'DEFERRED'
+        finally:
+            if not options['directory']:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        report = {
+            'config': {key: options[key] for key in ('readers', 'writers', 'duration', 'sheets', 'rows', 'batch_rows', 'timeout', 'seed')},
+            'pragmas': pragmas,
+            'options': tuned_options,
+            'results': results,
+            'speedup': {
+                key: results['tuned'][key] / results['default'][key] if results['default'][key] else None
+                for key in ('reads_per_second', 'rows_written_per_second')
+            },
+        }
+        self._write_table(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+    def _journal_mode(self, alias):
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                return cursor.fetchone()[0]
+        finally:
+            connections[alias].close()
+
+    def _seed(self, alias, options):
+        rng = random.Random(options['seed'])
+        try:
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                for statement in SCHEMA:
+                    cursor.execute(statement)
+                cursor.executemany(INSERT, [_row(rng, options['sheets']) for _ in range(options['rows'])])
+        finally:
+            connections[alias].close()
+
+    def _run(self, alias, options):
+        deadline = time.perf_counter() + options['duration']
+        read_latencies, write_latencies = [], []
+        errors = Counter()
+        written = [0]
+        lock = threading.Lock()
+
+        def reader(index):
+            rng = random.Random(options['seed'] * 1000 + index)
+            latencies = []
+            try:
+                with connections[alias].cursor() as cursor:
+                    while time.perf_counter() < deadline:
+                        start = time.perf_counter()
+                        try:
+                            cursor.execute(rng.choice(READS), (rng.randrange(options['sheets']),))
+                            cursor.fetchall()
+                            latencies.append(time.perf_counter() - start)
+                        except OperationalError as e:
+                            with lock:
+                                errors[f'read: {e}'] += 1
+            finally:
+                connections[alias].close()
+            with lock:
+                read_latencies.extend(latencies)
+
+        def writer(index):
+            rng = random.Random(options['seed'] * 1000 + 500 + index)
+            latencies = []
+            try:
+                while time.perf_counter() < deadline:
+                    sheet_id = rng.randrange(options['sheets'])
+                    rows = [_row(rng, options['sheets'], sheet_id) for _ in range(options['batch_rows'])]
+                    start = time.perf_counter()
+                    try:
+                        # Mirrors an upload followed by saving the analysis of the sheet; atomic()
+                        # begins the transaction with the configured transaction_mode
+                        with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                            cursor.executemany(INSERT, rows)
+                            cursor.execute(RESCORE, (sheet_id, options['batch_rows']))
+                        latencies.append(time.perf_counter() - start)
+                        with lock:
+                            written[0] += 2 * len(rows)
+                    except OperationalError as e:
+                        with lock:
+                            errors[f'write: {e}'] += 1
+            finally:
+                connections[alias].close()
+            with lock:
+                write_latencies.extend(latencies)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=reader, args=(i,), daemon=True) for i in range(options['readers'])]
+        threads += [threading.Thread(target=writer, args=(i,), daemon=True) for i in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        read_latencies.sort()
+        write_latencies.sort()
+        return {
+            'elapsed_seconds': elapsed,
+            'reads': len(read_latencies),
+            'reads_per_second': len(read_latencies) / elapsed,
+            'read_p50_ms': _ms(percentile(read_latencies, 0.50)),
+            'read_p95_ms': _ms(percentile(read_latencies, 0.95)),
+            'read_p99_ms': _ms(percentile(read_latencies, 0.99)),
+            'write_transactions': len(write_latencies),
+            'rows_written_per_second': written[0] / elapsed,
+            'write_p50_ms': _ms(percentile(write_latencies, 0.50)),
+            'write_p95_ms': _ms(percentile(write_latencies, 0.95)),
+            'errors': sum(errors.values()),
+            'error_kinds': dict(errors),
+        }
+
+    def _write_table(self, results):
+        self.stdout.write(
+            f"{'config':<8} {'journal':>8} {'begin':>9} {'reads/s':>9} {'read p95':>9} {'read p99':>9} "
+            f"{'rows/s':>9} {'write p95':>10} {'errors':>7}"
+        )
+        for name, stats in results.items():
+            self.stdout.write(
+                f"{name:<8} {stats['journal_mode']:>8} {stats['transaction_mode']:>9} {stats['reads_per_second']:>9.1f} "
+                f"{_cell(stats['read_p95_ms'])} {_cell(stats['read_p99_ms'])} "
+                f"{stats['rows_written_per_second']:>9.0f} {_cell(stats['write_p95_ms'], 10)} {stats['errors']:>7}"
+            )
+
+
+@contextlib.contextmanager
+def _scratch_database(path, db_options):
+    """Register a scratch SQLite file as a temporary database alias
+
+    Connections to it are created by Django like any other, so the connection_created
+    pragma receiver and the sqlite backend's transaction_mode both apply.
+    """
+    alias = f'sqlite_concurrency_{os.path.splitext(os.path.basename(path))[0]}'
+    # A throwaway handler fills in the defaults Django adds to every DATABASES entry
+    connections.settings[alias] = ConnectionHandler({
+        DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path, 'OPTIONS': db_options}
+    }).settings[DEFAULT_DB_ALIAS]
+    try:
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def _row(rng, sheets, sheet_id=None):
+    return (
+        rng.randrange(sheets) if sheet_id is None else sheet_id,
+        f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        f'Employee {rng.randrange(200):05d}',
+        f'Vendor {rng.randrange(500):05d}',
+        round(rng.lognormvariate(4.5, 1.0), 2),
+    )
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
+
+
+def _cell(value, width=9):
+    return f'{value:>{width}.1f}' if value is not None else f"{'-':>{width}}"
@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from core.db import REPLICA_ALIAS, record_replica_sync, replica_configured
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database into the read replica with the online backup API; '
+        'readers of the replica keep their snapshot until the copy commits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=-1,
+            help='Pages copied per step, letting writers in between steps; -1 copies in one step (default: -1)',
+        )
+
+    def handle(self, *args, **options):
+        if not replica_configured():
+            raise CommandError('No read replica configured; set ANALYTICS_READ_REPLICA_DB')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[REPLICA_ALIAS]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('sync_replica copies SQLite files; use the database\'s own replication otherwise')
+
+        start = time.perf_counter()
+        # Writes committed before the backup starts are in the copy; a backup that restarts
+        # because the primary changed only copies a later snapshot
+        snapshot_time = time.time()
+        primary.ensure_connection()
+        replica.ensure_connection()
+        primary.connection.backup(replica.connection, pages=options['pages'])
+        record_replica_sync(snapshot_time)
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {primary.settings_dict['NAME']} to {replica.settings_dict['NAME']} "
+            f"in {time.perf_counter() - start:.2f}s"
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from core.analytics import warm_up_models
+
+class Command(BaseCommand):
+    help = 'Preload trained models and run a synthetic scoring batch, reporting how long it took'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=200,
+            help='Number of synthetic expenses to score (default: 200)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Warming up analytics models...')
+        report = warm_up_models(n_rows=options['rows'])
+        
+        self.stdout.write(f"Model version: {report['model_version'] or 'none (statistical fallbacks)'}")
+        self.stdout.write(f"Models ready: {', '.join(report['models_ready']) or 'none'}")
+        self.stdout.write(f"Load time: {report['load_seconds']:.3f}s")
+        self.stdout.write(f"Scoring time ({report['rows']} rows): {report['scoring_seconds']:.3f}s")
+        self.stdout.write(self.style.SUCCESS(f"Warm-up completed in {report['total_seconds']:.3f}s"))
@@ -0,0 +1,133 @@
+"""Prometheus metrics for request latency, analysis throughput and model lifecycle
+
+With several worker processes (gunicorn), set ``PROMETHEUS_MULTIPROC_DIR`` to an empty,
+writable directory before the workers start. Every process then writes its samples to
+memory-mapped files in that directory and ``/metrics`` aggregates them, whichever worker
+serves the scrape. Call ``mark_process_dead`` from gunicorn's ``child_exit`` hook so the
+in-progress gauges of dead workers are dropped.
+"""
+import contextlib
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # Metrics are optional; recording becomes a no-op
+    prometheus_client = None
+
+MULTIPROC_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+THROUGHPUT_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 100000)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 5000)
+SQL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'analytics_http_request_duration_seconds', 'Request latency by route',
+        ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+    )
+    REQUEST_QUERIES = prometheus_client.Histogram(
+        'analytics_http_request_queries', 'SQL statements executed per request by route',
+        ['route'], buckets=QUERY_COUNT_BUCKETS
+    )
+    REQUEST_SQL_TIME = prometheus_client.Histogram(
+        'analytics_http_request_sql_seconds', 'Total SQL time per request by route',
+        ['route'], buckets=SQL_TIME_BUCKETS
+    )
+    ROWS_ANALYZED = prometheus_client.Counter(
+        'analytics_rows_analyzed_total', 'Expense rows scored by analyze_sheet'
+    )
+    ANALYSIS_DURATION = prometheus_client.Histogram(
+        'analytics_analysis_duration_seconds', 'Wall time of one analyze_sheet call', buckets=LATENCY_BUCKETS
+    )
+    ANALYSIS_THROUGHPUT = prometheus_client.Histogram(
+        'analytics_analysis_rows_per_second', 'Rows per second of one analyze_sheet call', buckets=THROUGHPUT_BUCKETS
+    )
+    TRAINING_DURATION = prometheus_client.Histogram(
+        'analytics_training_duration_seconds', 'Wall time of one train_models call',
+        ['outcome'], buckets=LATENCY_BUCKETS
+    )
+    MODEL_LOADS = prometheus_client.Counter(
+        'analytics_model_loads_total', 'Model versions read from disk', ['source']
+    )
+    MODEL_CACHE = prometheus_client.Counter(
+        'analytics_model_cache_requests_total', 'In-process model cache lookups', ['result']
+    )
+    LOG_RECORDS_DROPPED = prometheus_client.Counter(
+        'analytics_log_records_dropped_total', 'Log records dropped because the log writer fell behind'
+    )
+    # Analyses and training runs currently executing, summed over live workers
+    IN_PROGRESS = prometheus_client.Gauge(
+        'analytics_operations_in_progress', 'Analyses and training runs currently executing',
+        ['operation'], multiprocess_mode='livesum'
+    )
+
+
+def enabled():
+    return prometheus_client is not None
+
+
+def record_request(route, method, status, seconds):
+    if enabled():
+        REQUEST_LATENCY.labels(route=route, method=method, status=str(status)).observe(seconds)
+
+
+def record_request_queries(route, count, seconds):
+    if enabled():
+        REQUEST_QUERIES.labels(route=route).observe(count)
+        REQUEST_SQL_TIME.labels(route=route).observe(seconds)
+
+
+def record_analysis(rows, seconds):
+    if enabled():
+        ROWS_ANALYZED.inc(rows)
+        ANALYSIS_DURATION.observe(seconds)
+        if seconds > 0:
+            ANALYSIS_THROUGHPUT.observe(rows / seconds)
+
+
+def record_training(seconds, success):
+    if enabled():
+        TRAINING_DURATION.labels(outcome='success' if success else 'failure').observe(seconds)
+
+
+def record_model_load(source):
+    if enabled():
+        MODEL_LOADS.labels(source=source).inc()
+
+
+def record_model_cache(hit):
+    if enabled():
+        MODEL_CACHE.labels(result='hit' if hit else 'miss').inc()
+
+
+def record_log_dropped():
+    if enabled():
+        LOG_RECORDS_DROPPED.inc()
+
+
+@contextlib.contextmanager
+def track_in_progress(operation):
+    """Count an operation in the in-progress gauge while the block runs"""
+    if not enabled():
+        yield
+        return
+    with IN_PROGRESS.labels(operation=operation).track_inprogress():
+        yield
+
+
+def exposition():
+    """(body, content type) of the current metrics in Prometheus text format"""
+    if os.environ.get(MULTIPROC_ENV):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of an exited worker (gunicorn ``child_exit`` hook)"""
+    if enabled() and os.environ.get(MULTIPROC_ENV):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,213 @@
+import cProfile
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from django.conf import settings
+from . import metrics
+from .db import last_replica_sync, replica_configured, use_replica
+from .instrumentation import QueryCounter, count_queries
+from .profiling import StackSampler, profiling_authorized, safe_request_id
+
+logger = logging.getLogger(__name__)
+
+# Longest SQL text echoed in a response header
+HEADER_SQL_LENGTH = 200
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Cookie holding the time of a client's last write, which pins it to the primary until a
+# replica sync includes that write
+LAST_WRITE_COOKIE = 'analytics_last_write'
+
+
+def _route(request):
+    # View names keep label cardinality bounded, unlike raw paths with ids
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Record request latency per resolved route for the Prometheus endpoint"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        metrics.record_request(_route(request), request.method, response.status_code, time.perf_counter() - start)
+        return response
+
+
+class QueryStatsMiddleware:
+    """Count the SQL statements of each request, their total time and the slowest ones
+
+    Every request feeds the per-route query metrics. With DEBUG the numbers are also
+    returned as ``X-Query-*`` response headers; requests over the query budget or with a
+    slow statement are logged as warnings either way.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.keep_slowest = getattr(settings, 'ANALYTICS_QUERY_STATS_SLOWEST', 3)
+        self.count_warning = getattr(settings, 'ANALYTICS_QUERY_COUNT_WARNING', 50)
+        self.slow_seconds = getattr(settings, 'ANALYTICS_SLOW_QUERY_SECONDS', 0.25)
+
+    def __call__(self, request):
+        queries = QueryCounter(keep_slowest=self.keep_slowest)
+        with count_queries(queries):
+            response = self.get_response(request)
+
+        route = _route(request)
+        slowest = queries.slowest()
+        metrics.record_request_queries(route, queries.count, queries.seconds)
+
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(queries.count)
+            response['X-Query-Seconds'] = f'{queries.seconds:.6f}'
+            for rank, (seconds, sql) in enumerate(slowest, start=1):
+                response[f'X-Query-Slowest-{rank}'] = f'{seconds * 1000:.2f}ms {_header_sql(sql)}'
+
+        if queries.count > self.count_warning or (slowest and slowest[0][0] >= self.slow_seconds):
+            logger.warning(
+                "Request used %d queries in %.3fs", queries.count, queries.seconds,
+                extra={
+                    'route': route,
+                    'method': request.method,
+                    'path': request.path,
+                    'query_count': queries.count,
+                    'query_seconds': queries.seconds,
+                    'slowest_queries': [{'seconds': seconds, 'sql': sql} for seconds, sql in slowest],
+                }
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """Profile single requests on demand, authorized by ``ANALYTICS_PROFILING_TOKEN``
+
+    A request carrying the token in the ``X-Profile`` header (or ``?profile=<token>``)
+    runs under cProfile, or under the stack sampler with ``X-Profiler: sampling``
+    (``?profiler=sampling``). Files are written to ``ANALYTICS_PROFILE_DIR`` named by the
+    request id (``X-Request-ID`` when valid, else a new one, returned as ``X-Profile-Id``):
+    ``<id>.prof`` for cProfile, ``<id>.collapsed`` stacks for flame graphs in both modes,
+    and one line per profile in ``index.jsonl``. Without a configured token the middleware
+    does nothing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.directory = getattr(settings, 'ANALYTICS_PROFILE_DIR', 'profiles')
+        self.default_mode = getattr(settings, 'ANALYTICS_PROFILER', 'cprofile')
+        self.interval = getattr(settings, 'ANALYTICS_PROFILE_SAMPLE_INTERVAL', 0.005)
+
+    def __call__(self, request):
+        if not profiling_authorized(request):
+            return self.get_response(request)
+
+        mode = request.headers.get('X-Profiler') or request.GET.get('profiler') or self.default_mode
+        if mode not in ('cprofile', 'sampling'):
+            mode = self.default_mode
+        request_id = safe_request_id(request.headers.get('X-Request-ID')) or uuid.uuid4().hex
+
+        # The sampler always runs so both modes produce collapsed stacks
+        sampler = StackSampler(interval=self.interval).start()
+        profiler = cProfile.Profile() if mode == 'cprofile' else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            sampler.stop()
+        wall_seconds = time.perf_counter() - start
+
+        try:
+            files = self._write(request_id, profiler, sampler)
+            self._index(request, request_id, mode, response.status_code, wall_seconds, sampler.samples, files)
+            response['X-Profile-Id'] = request_id
+        except OSError:
+            logger.exception("Could not write request profile", extra={'request_id': request_id})
+        return response
+
+    def _write(self, request_id, profiler, sampler):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        if profiler is not None:
+            files.append(f'{request_id}.prof')
+            profiler.dump_stats(os.path.join(self.directory, files[-1]))
+        files.append(f'{request_id}.collapsed')
+        sampler.write_collapsed(os.path.join(self.directory, files[-1]))
+        return files
+
+    def _index(self, request, request_id, mode, status_code, wall_seconds, samples, files):
+        entry = {
+            'request_id': request_id,
+            'profiled_at': datetime.now(timezone.utc).isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'route': _route(request),
+            'status': status_code,
+            'profiler': mode,
+            'wall_seconds': wall_seconds,
+            'samples': samples,
+            'files': files,
+        }
+        with open(os.path.join(self.directory, 'index.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        logger.info("Request profiled", extra=entry)
+
+
+class ReadReplicaMiddleware:
+    """Serve read-only requests from the read replica, except for clients whose writes it lacks
+
+    A successful unsafe request sets a cookie with the time of the write. That client reads
+    from the primary until a ``sync_replica`` run started after the write, so the sheet list
+    after an upload keeps the new sheet however long the replica takes to catch up. The
+    cookie expires after ANALYTICS_READ_YOUR_WRITES_SECONDS at the latest, and is dropped
+    once a sync covers it. Does nothing without a replica.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replica_configured():
+            return self.get_response(request)
+
+        if request.method in SAFE_METHODS:
+            last_write = self._last_write(request)
+            synced = last_write is None or (last_replica_sync() or 0.0) > last_write
+            with use_replica(synced):
+                response = self.get_response(request)
+            if synced and last_write is not None:
+                response.delete_cookie(LAST_WRITE_COOKIE, samesite='Lax')
+            return response
+
+        response = self.get_response(request)
+        max_age = getattr(settings, 'ANALYTICS_READ_YOUR_WRITES_SECONDS', 86400.0)
+        if response.status_code < 400 and max_age > 0:
+            response.set_cookie(
+                LAST_WRITE_COOKIE, f'{time.time():.6f}', max_age=int(max_age), httponly=True, samesite='Lax'
+            )
+        return response
+
+    def _last_write(self, request):
+        try:
+            return float(request.COOKIES[LAST_WRITE_COOKIE])
+        except (KeyError, ValueError):
+            return None
+
+
+def _header_sql(sql):
+    sql = ' '.join(sql.split())
+    if len(sql) > HEADER_SQL_LENGTH:
+        sql = sql[:HEADER_SQL_LENGTH - 3] + '...'
+    return sql.encode('ascii', 'replace').decode('ascii')
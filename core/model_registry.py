@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from django.utils import timezone
+
+CURRENT_POINTER = 'CURRENT'
+VERSIONS_DIR = 'versions'
+MANIFEST_FILE = 'manifest.json'
+
+
+class ModelRegistry:
+    """Immutable versioned model directories behind an atomically swapped pointer
+
+    Layout under ``root``::
+
+        versions/<version>/manifest.json   feature list, watermark, metrics, checksums
+        versions/<version>/...             model artifacts, never modified once published
+        CURRENT                            name of the version workers should serve
+
+    Training writes into a staging directory and publishes it with ``publish``.
+    Readers only need to read ``CURRENT`` to know whether a reload is due.
+    """
+
+    def __init__(self, root, keep_versions=5):
+        self.root = os.path.abspath(root)
+        self.versions_path = os.path.join(self.root, VERSIONS_DIR)
+        self.pointer_path = os.path.join(self.root, CURRENT_POINTER)
+        self.keep_versions = keep_versions
+        os.makedirs(self.versions_path, exist_ok=True)
+
+    def create_staging_dir(self):
+        """Private directory new artifacts are written to before publishing"""
+        return tempfile.mkdtemp(prefix='.staging-', dir=self.versions_path)
+
+    def discard(self, staging_dir):
+        """Remove an unpublished staging directory"""
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def publish(self, staging_dir, manifest):
+        """Freeze a staging directory as a new version and point CURRENT at it"""
+        # Microseconds keep versions published within the same second in publish order
+        version = f"{timezone.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+        manifest = dict(manifest)
+        manifest['version'] = version
+        manifest['created_at'] = timezone.now().isoformat()
+        manifest['checksums'] = self._checksums(staging_dir)
+        self._write_atomic(os.path.join(staging_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+
+        # Rename within the same filesystem is atomic; the directory appears complete or not at all
+        os.rename(staging_dir, self.version_dir(version))
+        self._write_atomic(self.pointer_path, version)
+
+        self._prune(keep=version)
+        return version
+
+    def current_version(self):
+        """Version named by the CURRENT pointer, or None before the first publish"""
+        try:
+            with open(self.pointer_path) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_path, version)
+
+    def load_manifest(self, version):
+        with open(os.path.join(self.version_dir(version), MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def verify(self, version, manifest=None):
+        """Check every artifact of a version against its manifest checksums"""
+        if manifest is None:
+            manifest = self.load_manifest(version)
+        return self._checksums(self.version_dir(version)) == manifest.get('checksums', {})
+
+    def list_versions(self):
+        """Published versions, oldest first"""
+        return sorted(
+            name for name in os.listdir(self.versions_path)
+            if not name.startswith('.') and os.path.isdir(os.path.join(self.versions_path, name))
+        )
+
+    def _prune(self, keep):
+        """Delete the oldest versions beyond the retention limit"""
+        versions = [v for v in self.list_versions() if v != keep]
+        excess = len(versions) + 1 - self.keep_versions
+        for version in versions[:max(0, excess)]:
+            shutil.rmtree(self.version_dir(version), ignore_errors=True)
+
+    def _checksums(self, directory):
+        checksums = {}
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, directory)
+                if relpath == MANIFEST_FILE:
+                    continue
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                checksums[relpath] = digest.hexdigest()
+        return checksums
+
+    def _write_atomic(self, path, content):
+        """Write a file via a temp file and os.replace so readers never see a partial write"""
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
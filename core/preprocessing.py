@@ -0,0 +1,97 @@
+from .lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sklearn_preprocessing = lazy_import('sklearn.preprocessing')
+
+# Bump whenever encoding, column order or scaling changes so stale artifacts are rejected
+PREPROCESSOR_VERSION = 1
+
+NUMERIC_FEATURE_COLUMNS = [
+    'amount_log', 'amount_zscore', 'day_of_week', 'month', 'day_of_month',
+    'employee_frequency', 'vendor_frequency', 'category_frequency',
+    'amount_percentile', 'duplicate_description', 'duplicate_amount', 'duplicate_vendor'
+]
+
+CATEGORICAL_COLUMNS = [
+    'category', 'subcategory', 'employee', 'department',
+    'currency', 'payment_method', 'vendor_supplier', 'status', 'approved_by'
+]
+
+
+class ExpensePreprocessor:
+    """Fitted encoding, column ordering and scaling shared by training and inference"""
+
+    def __init__(self):
+        self.version = PREPROCESSOR_VERSION
+        self.categories = {}  # column -> pd.Index of known values, code = position
+        self.scaler = sklearn_preprocessing.StandardScaler()
+        self.fitted = False
+
+    @property
+    def input_columns(self):
+        """DataFrame columns consumed by the transform"""
+        return NUMERIC_FEATURE_COLUMNS + CATEGORICAL_COLUMNS
+
+    @property
+    def feature_columns(self):
+        """Model feature names in matrix column order"""
+        return NUMERIC_FEATURE_COLUMNS + [col + '_encoded' for col in CATEGORICAL_COLUMNS]
+
+    def is_compatible(self):
+        """Check that a loaded preprocessor matches the current code"""
+        return self.fitted and getattr(self, 'version', None) == PREPROCESSOR_VERSION
+
+    def fit(self, df):
+        """Learn category vocabularies and scaling from a featurized DataFrame"""
+        for col in CATEGORICAL_COLUMNS:
+            self.categories[col] = pd.Index(np.sort(df[col].astype(str).unique()))
+
+        self.scaler.fit(self.encode(df))
+        self.fitted = True
+        return self
+
+    def set_vocabulary(self, vocabulary):
+        """Use fixed category vocabularies (column -> values in code order)"""
+        self.categories = {col: pd.Index(list(values), dtype=object) for col, values in vocabulary.items()}
+        return self
+
+    def fit_encoded(self, X, vocabulary):
+        """Fit scaling on a matrix already encoded with ``vocabulary``"""
+        self.set_vocabulary(vocabulary)
+        self.scaler.fit(X)
+        self.fitted = True
+        return self
+
+    def encode(self, df):
+        """Build the unscaled feature matrix; unseen categories encode to -1"""
+        n_numeric = len(NUMERIC_FEATURE_COLUMNS)
+        X = np.zeros((len(df), n_numeric + len(CATEGORICAL_COLUMNS)), dtype=np.float64)
+
+        for j, col in enumerate(NUMERIC_FEATURE_COLUMNS):
+            if col in df.columns:
+                X[:, j] = df[col].to_numpy(dtype=np.float64, na_value=0.0)
+
+        for j, col in enumerate(CATEGORICAL_COLUMNS):
+            vocabulary = self.categories.get(col)
+            if vocabulary is None or col not in df.columns:
+                X[:, n_numeric + j] = -1
+            else:
+                X[:, n_numeric + j] = vocabulary.get_indexer(df[col].astype(str))
+
+        # Mirrors the previous fillna(0) for degenerate statistics such as a zero std
+        np.nan_to_num(X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        return X
+
+    def transform(self, df):
+        """Encode and scale a featurized DataFrame in a single pass"""
+        return self.scale(self.encode(df))
+
+    def scale(self, X):
+        """Scale an encoded matrix in place when fitted"""
+        if self.fitted:
+            X = self.scaler.transform(X, copy=False)
+        return X
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
@@ -0,0 +1,75 @@
+import hmac
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from django.conf import settings
+
+# Request ids become file names, so only accept simple tokens from clients
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def safe_request_id(value):
+    """``value`` when it is usable as a file name, otherwise None"""
+    if value and _REQUEST_ID_PATTERN.match(value):
+        return value
+    return None
+
+
+def profiling_authorized(request):
+    """Whether the request carries ``ANALYTICS_PROFILING_TOKEN`` (X-Profile header or ?profile=)"""
+    token = getattr(settings, 'ANALYTICS_PROFILING_TOKEN', '')
+    if not token:
+        return False
+    supplied = request.headers.get('X-Profile') or request.GET.get('profile')
+    return bool(supplied) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def _frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Sample the stack of one thread at a fixed interval from a background thread
+
+    Identical stacks are counted, which is what flame graph tools consume: ``write_collapsed``
+    writes one ``root;...;leaf count`` line per distinct stack. Only the profiled thread is
+    sampled, so work it hands to thread pools shows up as waiting.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='analytics-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
@@ -0,0 +1,112 @@
+import heapq
+import math
+import os
+import tempfile
+from .lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+joblib = lazy_import('joblib')
+
+
+class StratifiedReservoirSampler:
+    """Bounded, recency-weighted sample of training rows kept per stratum
+
+    Every stratum (e.g. department) gets an equal share of ``capacity``. Strata should not
+    be time windows: each would keep its full share however old it gets, undoing the decay.
+    Within a stratum rows are kept by weighted reservoir sampling (Efraimidis-Spirakis)
+    with forward exponential decay: an item offered at time ``t`` gets the key
+    ``log(u) * exp(-decay * (t - landmark))``, so newer rows outrank older ones with a
+    half-life of ``half_life_days`` while keys never need to be recomputed. The sample
+    can therefore be maintained incrementally as new sheets arrive.
+
+    The landmark defaults to the earliest timestamp of the first batch, which keeps the
+    decay factor in floating-point range for realistic spans of history.
+    """
+
+    def __init__(self, capacity, half_life_days=180, landmark=None, metadata=None, seed=42):
+        self.capacity = int(capacity)
+        self.half_life_days = half_life_days
+        self.decay = math.log(2) / (half_life_days * 86400.0) if half_life_days else 0.0
+        self.landmark = landmark
+        self.metadata = dict(metadata or {})  # Caller-defined settings persisted with the sample
+        self.reservoirs = {}  # stratum -> min-heap of (key, sequence, item)
+        self.rows_seen = 0
+        self.watermark = None  # Caller-defined high-water mark of ingested data
+        self._sequence = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.reservoirs.values())
+
+    @property
+    def params(self):
+        """Settings that must match for a persisted sample to be reused"""
+        return {'capacity': self.capacity, 'half_life_days': self.half_life_days, 'metadata': self.metadata}
+
+    @property
+    def stratum_capacity(self):
+        return max(1, self.capacity // max(1, len(self.reservoirs)))
+
+    def offer_many(self, strata, timestamps, items):
+        """Offer rows with their stratum and timestamp (seconds since the epoch)"""
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if not len(timestamps):
+            return
+        if self.landmark is None:
+            self.landmark = float(timestamps.min())
+        uniforms = self._rng.random(len(timestamps))
+        # Keys are <= 0; larger keys (closer to 0) win, recent rows shrink toward 0
+        keys = np.log(np.maximum(uniforms, 1e-300)) * np.exp(-self.decay * (timestamps - self.landmark))
+
+        new_strata = False
+        for stratum, key, item in zip(strata, keys.tolist(), items):
+            heap = self.reservoirs.get(stratum)
+            if heap is None:
+                heap = self.reservoirs[stratum] = []
+                new_strata = True
+            self._sequence += 1
+            entry = (key, self._sequence, item)
+            if len(heap) < self.stratum_capacity:
+                heapq.heappush(heap, entry)
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+            self.rows_seen += 1
+
+        if new_strata:
+            self._rebalance()
+
+    def _rebalance(self):
+        """Shrink every stratum to its share after new strata appear"""
+        limit = self.stratum_capacity
+        for heap in self.reservoirs.values():
+            while len(heap) > limit:
+                heapq.heappop(heap)
+
+    def retain(self, keep):
+        """Drop sampled items for which ``keep(item)`` is false, e.g. rows that were replaced"""
+        for stratum, heap in self.reservoirs.items():
+            kept = [entry for entry in heap if keep(entry[2])]
+            if len(kept) != len(heap):
+                heapq.heapify(kept)
+                self.reservoirs[stratum] = kept
+
+    def items(self):
+        """Sampled items, grouped by stratum"""
+        return [entry[2] for heap in self.reservoirs.values() for entry in heap]
+
+    def save(self, path):
+        """Persist the sampler atomically"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            joblib.dump(self, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        return joblib.load(path)
@@ -0,0 +1,10 @@
+import math
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    # Rounding first keeps products like 0.07 * 100 = 7.000000000000001 on their rank
+    rank = math.ceil(round(fraction * len(sorted_values), 9)) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
@@ -0,0 +1,196 @@
+"""Vectorized synthetic expense data for benchmarks, load tests and scale reproductions"""
+import io
+from datetime import date
+from decimal import Decimal
+from django.db import connection, transaction
+from .lazy_imports import lazy_import
+from .models import Expense, ExpenseSheet
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Category -> (subcategories, lognormal mean and sigma of the amount)
+CATEGORIES = {
+    'Travel': (['Airfare', 'Hotel', 'Taxi', 'Car Rental'], 5.5, 0.9),
+    'Meals': (['Client Lunch', 'Team Dinner', 'Per Diem'], 3.6, 0.6),
+    'Office Supplies': (['Paper', 'Printer Ink', 'Furniture'], 3.8, 0.8),
+    'Software': (['Subscription', 'License'], 5.0, 1.0),
+    'Training': (['Course', 'Conference'], 6.0, 0.7),
+}
+
+DEFAULT_PROFILE = {
+    'employees': 200,
+    'vendors': 500,
+    'approvers': 20,
+    'departments': ['Sales', 'Engineering', 'Marketing', 'Finance', 'HR', 'Operations'],
+    'categories': CATEGORIES,
+    'vendor_skew': 1.2,  # Zipf exponent of vendor popularity; 0 for uniform
+    'amount_scale': 1.0,  # Multiplier applied to every amount
+    'payment_methods': {'Corporate Card': 0.6, 'Personal Card': 0.25, 'Bank Transfer': 0.1, 'Cash': 0.05},
+    'statuses': {'Approved': 0.85, 'Pending': 0.1, 'Rejected': 0.05},
+    'currency': 'USD',
+    'start_date': date(2024, 1, 1),
+    'days': 90,
+}
+
+# Fraud patterns inject_fraud can plant, with their default share of rows
+FRAUD_RATES = {
+    'duplicate': 0.01,  # Resubmission of another expense: same employee, vendor, amount, description
+    'round_amount': 0.01,  # Suspiciously round, inflated amount
+    'weekend': 0.01,  # Spend moved to a Saturday or Sunday
+}
+
+# Expense columns produced by expense_frame, in Expense model field order
+COLUMNS = [
+    'date', 'category', 'subcategory', 'description', 'employee', 'department', 'amount', 'currency',
+    'payment_method', 'vendor_supplier', 'receipt_number', 'status', 'approved_by', 'notes'
+]
+
+
+def expense_frame(n_rows, profile=None, seed=0, receipt_offset=0):
+    """DataFrame of ``n_rows`` expenses drawn from ``profile`` (DEFAULT_PROFILE overrides)"""
+    profile = {**DEFAULT_PROFILE, **(profile or {})}
+    rng = np.random.default_rng(seed)
+
+    # Fixed population: every employee belongs to one department
+    employees = np.array([f'Employee {i:05d}' for i in range(profile['employees'])], dtype=object)
+    employee_departments = rng.choice(np.array(profile['departments'], dtype=object), size=len(employees))
+    vendors = np.array([f'Vendor {i:05d}' for i in range(profile['vendors'])], dtype=object)
+    approvers = np.array([f'Manager {i:03d}' for i in range(profile['approvers'])], dtype=object)
+    vendor_weights = 1.0 / np.arange(1, len(vendors) + 1) ** profile['vendor_skew']
+    vendor_weights /= vendor_weights.sum()
+
+    employee_idx = rng.integers(0, len(employees), size=n_rows)
+    vendor = vendors[rng.choice(len(vendors), size=n_rows, p=vendor_weights)]
+
+    category_names = list(profile['categories'])
+    category_idx = rng.integers(0, len(category_names), size=n_rows)
+    subcategory = np.empty(n_rows, dtype=object)
+    amount = np.empty(n_rows, dtype=np.float64)
+    for k, name in enumerate(category_names):
+        subcategories, mean, sigma = profile['categories'][name]
+        rows = np.flatnonzero(category_idx == k)
+        subcategory[rows] = rng.choice(np.array(subcategories, dtype=object), size=len(rows))
+        amount[rows] = rng.lognormal(mean, sigma, size=len(rows))
+    category = np.array(category_names, dtype=object)[category_idx]
+
+    payment_methods, payment_p = zip(*profile['payment_methods'].items())
+    statuses, status_p = zip(*profile['statuses'].items())
+    start = np.datetime64(profile['start_date'], 'D')
+
+    frame = pd.DataFrame({
+        'date': pd.to_datetime(start + rng.integers(0, profile['days'], size=n_rows)),
+        'category': category,
+        'subcategory': subcategory,
+        'description': pd.Series(subcategory) + ' - ' + pd.Series(vendor),
+        'employee': employees[employee_idx],
+        'department': employee_departments[employee_idx],
+        'amount': np.round(np.maximum(amount * profile['amount_scale'], 1.0), 2),
+        'currency': profile['currency'],
+        'payment_method': rng.choice(np.array(payment_methods, dtype=object), size=n_rows, p=_normalized(payment_p)),
+        'vendor_supplier': vendor,
+        'receipt_number': 'R' + pd.Series(np.arange(receipt_offset, receipt_offset + n_rows)).astype(str).str.zfill(9),
+        'status': rng.choice(np.array(statuses, dtype=object), size=n_rows, p=_normalized(status_p)),
+        'approved_by': approvers[rng.integers(0, len(approvers), size=n_rows)],
+        'notes': '',
+    })
+    return frame[COLUMNS]
+
+
+def inject_fraud(frame, rates=None, seed=0):
+    """Plant known fraud patterns in disjoint random rows of ``frame`` (modified in place)
+
+    ``rates`` maps pattern names of FRAUD_RATES to the share of rows to alter. Returns an
+    object array holding the pattern name of every altered row and None elsewhere.
+    """
+    rates = {**FRAUD_RATES, **(rates or {})}
+    unknown = sorted(set(rates) - set(FRAUD_RATES))
+    if unknown:
+        raise ValueError(f"Unknown fraud patterns: {', '.join(unknown)}")
+
+    rng = np.random.default_rng(seed)
+    n_rows = len(frame)
+    patterns = np.full(n_rows, None, dtype=object)
+    order = rng.permutation(n_rows)
+    columns = {name: frame.columns.get_loc(name) for name in ('date', 'amount', 'receipt_number')}
+
+    # Assign disjoint rows to every pattern up front; the rest stay untouched
+    assigned = {}
+    position = 0
+    for name in FRAUD_RATES:
+        count = min(int(round(rates[name] * n_rows)), n_rows - position)
+        assigned[name] = order[position:position + count]
+        position += count
+    untouched = order[position:]
+
+    for name, rows in assigned.items():
+        count = len(rows)
+        if not count:
+            continue
+        patterns[rows] = name
+
+        if name == 'duplicate':
+            # Copy untouched rows, keeping each duplicate's own receipt number, a few days later.
+            # Sources must not carry another pattern, or the duplicate would not match them
+            sources = untouched[rng.integers(0, len(untouched), size=count)] if len(untouched) else rows
+            receipts = frame.iloc[rows, columns['receipt_number']].to_numpy()
+            frame.iloc[rows] = frame.iloc[sources].to_numpy()
+            frame.iloc[rows, columns['receipt_number']] = receipts
+            dates = frame.iloc[rows, columns['date']] + pd.to_timedelta(rng.integers(0, 4, size=count), unit='D')
+            frame.iloc[rows, columns['date']] = dates.to_numpy()
+        elif name == 'round_amount':
+            step = rng.choice(np.array([100.0, 250.0, 500.0, 1000.0]), size=count)
+            amounts = frame.iloc[rows, columns['amount']].to_numpy(dtype=np.float64) * rng.uniform(1.5, 4.0, size=count)
+            frame.iloc[rows, columns['amount']] = np.maximum(np.round(amounts / step), 1) * step
+        elif name == 'weekend':
+            dates = frame.iloc[rows, columns['date']]
+            shift = (5 - dates.dt.dayofweek.to_numpy()) + rng.integers(0, 2, size=count)
+            frame.iloc[rows, columns['date']] = (dates + pd.to_timedelta(shift, unit='D')).to_numpy()
+    return patterns
+
+
+def _normalized(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    return weights / weights.sum()
+
+
+def insert_expenses(expense_sheet, frame, batch_size=50000):
+    """Insert the rows of ``frame`` into ``expense_sheet`` with batched executemany
+
+    Bypasses model instances and per-row saves, which dominate bulk_create at millions of
+    rows. Updates the sheet totals and returns the number of rows inserted.
+    """
+    table = connection.ops.quote_name(Expense._meta.db_table)
+    columns = [Expense._meta.get_field(name).column for name in COLUMNS] + ['expense_sheet_id']
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        table, ', '.join(connection.ops.quote_name(col) for col in columns), ', '.join(['%s'] * len(columns))
+    )
+
+    values = frame.assign(date=frame['date'].dt.strftime('%Y-%m-%d'), expense_sheet_id=expense_sheet.id)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(values), batch_size):
+            chunk = values.iloc[start:start + batch_size]
+            cursor.executemany(sql, list(chunk[COLUMNS + ['expense_sheet_id']].itertuples(index=False, name=None)))
+
+    expense_sheet.total_expenses += len(frame)
+    expense_sheet.total_amount += Decimal(f"{frame['amount'].sum():.2f}")
+    expense_sheet.save(update_fields=['total_expenses', 'total_amount'])
+    return len(frame)
+
+
+def create_sheet(sheet_name, frame, sheet_date=None, batch_size=50000):
+    """New ExpenseSheet holding the rows of ``frame``"""
+    expense_sheet = ExpenseSheet.objects.create(sheet_name=sheet_name, sheet_date=sheet_date or date.today())
+    insert_expenses(expense_sheet, frame, batch_size=batch_size)
+    return expense_sheet
+
+
+def upload_csv(frame, header=True):
+    """CSV text in the format accepted by the upload endpoint"""
+    from .views import FIELD_MAP
+
+    csv_frame = frame.assign(date=frame['date'].dt.strftime('%m/%d/%Y'))
+    csv_frame = csv_frame[list(FIELD_MAP)].rename(columns=FIELD_MAP)
+    buffer = io.StringIO()
+    csv_frame.to_csv(buffer, index=False, header=header)
+    return buffer.getvalue()
@@ -0,0 +1,28 @@
+import contextlib
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting how many SQL statements a block or endpoint may issue
+
+    Budgets should not grow with the number of rows involved; asserting the same budget
+    with one and with many rows is what catches an N+1 loop.
+    """
+
+    @contextlib.contextmanager
+    def assertQueryBudget(self, budget, using=DEFAULT_DB_ALIAS):
+        with CaptureQueriesContext(connections[using]) as captured:
+            yield captured
+        executed = len(captured.captured_queries)
+        if executed > budget:
+            statements = '\n'.join(
+                f'{i}. {query["sql"]}' for i, query in enumerate(captured.captured_queries, start=1)
+            )
+            self.fail(f'{executed} queries executed, budget is {budget}:\n{statements}')
+
+    def assertEndpointQueryBudget(self, path, budget, method='get', **kwargs):
+        """Request ``path`` with the test client within ``budget`` queries; returns the response"""
+        with self.assertQueryBudget(budget):
+            response = getattr(self.client, method)(path, **kwargs)
+        return response
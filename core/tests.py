@@ -1,3 +1,861 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from .models import Expense, ExpenseAnalysis, ExpenseSheet, SheetAnalysis
+from .testing import QueryBudgetMixin
+from .views import _flagged_expenses
 
-# Create your tests here.
+# Modules that must only load when an analysis or training actually runs
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'scipy', 'xgboost', 'joblib']
+
+IMPORT_BENCHMARK_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import core.urls
+import core.management.commands.analyze_sheets
+import core.management.commands.scheduled_training
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'heavy_modules': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+class ImportTimeBenchmarkTests(SimpleTestCase):
+    """Fails when app startup starts importing the ML stack or exceeds its time budget
+
+    The wall-clock budget only runs with ANALYTICS_CHECK_IMPORT_TIME=1, since it flakes on
+    loaded CI machines; the heavy-module check is deterministic and always runs.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Fresh interpreter so modules imported by the test runner do not skew the result
+        output = subprocess.run(
+            [sys.executable, '-c', IMPORT_BENCHMARK_SCRIPT],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'analytics.settings')},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        cls.result = json.loads(output.strip().splitlines()[-1])
+
+    def test_startup_does_not_import_heavy_modules(self):
+        self.assertEqual(self.result['heavy_modules'], [])
+
+    @unittest.skipUnless(os.environ.get('ANALYTICS_CHECK_IMPORT_TIME') == '1', 'set ANALYTICS_CHECK_IMPORT_TIME=1 to check')
+    def test_startup_within_time_budget(self):
+        budget = getattr(settings, 'ANALYTICS_IMPORT_TIME_BUDGET_SECONDS', 1.0)
+        self.assertLess(
+            self.result['seconds'], budget,
+            f"Importing the app took {self.result['seconds']:.2f}s (budget {budget:.2f}s)"
+        )
+
+
+class AsyncLoggingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='logging-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.log_file = os.path.join(directory, 'app.log')
+
+    def _handler(self, **kwargs):
+        import logging
+        from .logging_utils import AsyncQueueHandler
+
+        handler = AsyncQueueHandler(filename=self.log_file, **kwargs)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.addCleanup(handler.listener.handlers[0].close)
+        return handler
+
+    def _record(self, message):
+        import logging
+
+        return logging.LogRecord('core.test', logging.WARNING, __file__, 0, message, (), None)
+
+    def _logged(self):
+        with open(self.log_file) as f:
+            return f.read().splitlines()
+
+    def test_full_queue_drops_and_counts_records(self):
+        from prometheus_client import REGISTRY
+
+        handler = self._handler(max_queue_size=1)
+        handler.stop()
+        dropped = lambda: REGISTRY.get_sample_value('analytics_log_records_dropped_total') or 0
+        dropped_before = dropped()
+        for i in range(3):
+            handler.handle(self._record(f'record {i}'))
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(dropped() - dropped_before, 2)
+
+    def test_forked_child_gets_a_running_writer(self):
+        handler = self._handler()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                handler.handle(self._record('from child'))
+                handler.stop()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        handler.handle(self._record('from parent'))
+        handler.stop()
+        self.assertEqual(sorted(self._logged()), ['from child', 'from parent'])
+
+    def test_only_per_row_events_are_sampled(self):
+        import logging
+        from .logging_utils import SamplingFilter
+
+        self.assertFalse([f for f in logging.getLogger().handlers[0].filters if isinstance(f, SamplingFilter)])
+        self.assertTrue([f for f in logging.getLogger('core.views.rows').filters if isinstance(f, SamplingFilter)])
+        self.assertFalse(logging.getLogger('core.analytics').filters)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Endpoint query counts must not grow with the number of sheets or expenses"""
+
+    def _create_sheet(self, name, n_expenses, analyzed=True):
+        sheet = ExpenseSheet.objects.create(sheet_name=name, sheet_date=date(2024, 1, 1), total_expenses=n_expenses)
+        sheet_analysis = None
+        if analyzed:
+            sheet_analysis = SheetAnalysis.objects.create(
+                expense_sheet=sheet, overall_fraud_score=10, isolation_forest_score=0,
+                xgboost_score=0, lof_score=0, random_forest_score=0
+            )
+        for i in range(n_expenses):
+            expense = Expense.objects.create(
+                expense_sheet=sheet, date=date(2024, 1, 1), category='Travel', subcategory='Taxi',
+                description=f'Ride {i}', employee='Alice', department='Sales', amount=Decimal('12.50'),
+                currency='USD', payment_method='Card', vendor_supplier='Cabs', receipt_number=str(i),
+                status='Approved', approved_by='Bob'
+            )
+            if sheet_analysis is not None:
+                ExpenseAnalysis.objects.create(
+                    expense=expense, sheet_analysis=sheet_analysis, fraud_score=25 * (i % 3), risk_level='LOW'
+                )
+        return sheet
+
+    def test_sheet_list_budget(self):
+        for i in range(5):
+            self._create_sheet(f'analyzed-{i}', 1)
+            self._create_sheet(f'pending-{i}', 1, analyzed=False)
+        response = self.assertEndpointQueryBudget('/api/expenses/', 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 10)
+
+    def test_sheet_detail_budget(self):
+        sheet = self._create_sheet('detail', 20)
+        response = self.assertEndpointQueryBudget(f'/api/sheets/{sheet.id}/', 2)
+        self.assertEqual(response.json()['total_expenses'], 20)
+
+    def test_expense_endpoints_budget(self):
+        expense = self._create_sheet('single', 1).expenses.get()
+        self.assertEndpointQueryBudget(f'/api/expenses/{expense.id}/analysis/', 2)
+        self.assertEndpointQueryBudget(f'/api/expenses/{expense.id}/debug/', 1)
+
+    def test_flagged_expenses_budget(self):
+        sheet = self._create_sheet('flagged', 30)
+        with self.assertQueryBudget(1):
+            flagged = _flagged_expenses(sheet)
+        self.assertEqual(len(flagged), 20)
+        self.assertEqual(flagged[0]['fraud_score'], 50)
+
+    @override_settings(DEBUG=True)
+    def test_query_stats_headers(self):
+        self._create_sheet('headers', 3)
+        response = self.client.get('/api/expenses/')
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertIn('X-Query-Slowest-1', response)
+
+
+class ExpensePreprocessorTests(SimpleTestCase):
+    def _frame(self, departments):
+        import pandas as pd
+        from .preprocessing import CATEGORICAL_COLUMNS, NUMERIC_FEATURE_COLUMNS
+
+        n = len(departments)
+        df = pd.DataFrame({col: [float(i) for i in range(n)] for col in NUMERIC_FEATURE_COLUMNS})
+        for col in CATEGORICAL_COLUMNS:
+            df[col] = 'x'
+        df['department'] = departments
+        return df
+
+    def test_unseen_categories_encode_to_minus_one(self):
+        from .preprocessing import ExpensePreprocessor
+
+        preprocessor = ExpensePreprocessor().fit(self._frame(['Sales', 'Engineering', 'Sales']))
+        column = preprocessor.feature_columns.index('department_encoded')
+        codes = preprocessor.encode(self._frame(['Engineering', 'Sales', 'Legal']))[:, column]
+        self.assertEqual(codes.tolist(), [0, 1, -1])
+
+    def test_pickle_round_trip_and_version_check(self):
+        import pickle
+        import numpy as np
+        from . import preprocessing
+        from .preprocessing import ExpensePreprocessor
+
+        self.assertFalse(ExpensePreprocessor().is_compatible())
+        df = self._frame(['Sales', 'Engineering', 'Finance'])
+        fitted = ExpensePreprocessor().fit(df)
+        restored = pickle.loads(pickle.dumps(fitted))
+        self.assertTrue(restored.is_compatible())
+        np.testing.assert_array_equal(restored.transform(df), fitted.transform(df))
+
+        with mock.patch.object(preprocessing, 'PREPROCESSOR_VERSION', preprocessing.PREPROCESSOR_VERSION + 1):
+            self.assertFalse(restored.is_compatible())
+
+
+class CategoryVocabularyTests(TestCase):
+    def test_one_distinct_query_per_column_across_sheets(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import synthetic
+        from .analytics import ExpenseSheetAnalyzer
+        from .preprocessing import CATEGORICAL_COLUMNS
+
+        model_dir = tempfile.mkdtemp(prefix='vocabulary-test-')
+        self.addCleanup(shutil.rmtree, model_dir, True)
+        departments = [['Sales', 'HR'], ['Finance'], ['Legal', 'Sales']]
+        sheets = [
+            synthetic.create_sheet(f'vocabulary-{i}', synthetic.expense_frame(30, profile={'departments': names}, seed=i))
+            for i, names in enumerate(departments)
+        ]
+        with override_settings(ANALYTICS_MODEL_DIR=model_dir):
+            analyzer = ExpenseSheetAnalyzer()
+            store = analyzer._feature_store()
+            with store.locked(), CaptureQueriesContext(connection) as queries:
+                analyzer._materialize_sheets(store, sheets[:2])
+            distinct = [q['sql'] for q in queries.captured_queries if 'DISTINCT' in q['sql']]
+            self.assertEqual(len(distinct), len(CATEGORICAL_COLUMNS))
+            self.assertEqual(store.vocabulary['department'], ['Finance', 'HR', 'Sales'])
+
+            # Later runs only append, so codes of rows stored earlier keep their meaning
+            with store.locked():
+                analyzer._materialize_sheets(store, sheets[2:])
+            self.assertEqual(store.vocabulary['department'], ['Finance', 'HR', 'Sales', 'Legal'])
+            column = store.feature_columns.index('department_encoded')
+            codes = store.array('features')[:, column]
+            self.assertEqual(sorted(set(codes.tolist())), [0, 1, 2, 3])
+
+
+class ModelRegistryTests(SimpleTestCase):
+    def setUp(self):
+        from .model_registry import ModelRegistry
+
+        self.root = tempfile.mkdtemp(prefix='model-registry-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.registry = ModelRegistry(self.root, keep_versions=2)
+
+    def _publish(self, content):
+        staging_dir = self.registry.create_staging_dir()
+        with open(os.path.join(staging_dir, 'model.pkl'), 'w') as f:
+            f.write(content)
+        return self.registry.publish(staging_dir, {'models': []})
+
+    def test_publish_swaps_pointer_and_prunes_old_versions(self):
+        self.assertIsNone(self.registry.current_version())
+        versions = [self._publish(f'model {i}') for i in range(3)]
+        self.assertEqual(self.registry.current_version(), versions[-1])
+        self.assertEqual(self.registry.list_versions(), versions[1:])
+        manifest = self.registry.load_manifest(versions[-1])
+        self.assertEqual(manifest['version'], versions[-1])
+        self.assertEqual(list(manifest['checksums']), ['model.pkl'])
+        self.assertTrue(self.registry.verify(versions[-1]))
+        # Published staging directories were renamed, not copied
+        self.assertFalse([name for name in os.listdir(self.registry.versions_path) if name.startswith('.staging')])
+
+    def test_modified_artifact_fails_verification_and_is_not_loaded(self):
+        import joblib
+        import numpy as np
+        from .analytics import ExpenseSheetAnalyzer, _model_cache
+        from .preprocessing import ExpensePreprocessor
+
+        staging_dir = self.registry.create_staging_dir()
+        preprocessor = ExpensePreprocessor()
+        preprocessor.fit_encoded(np.zeros((2, len(preprocessor.feature_columns))), {})
+        joblib.dump(preprocessor, os.path.join(staging_dir, 'preprocessor.pkl'))
+        version = self.registry.publish(staging_dir, {'models': []})
+
+        self.addCleanup(_model_cache.pop, self.registry.root, None)
+        with override_settings(ANALYTICS_MODEL_DIR=self.root):
+            self.assertEqual(ExpenseSheetAnalyzer().model_version, version)
+
+            _model_cache.pop(self.registry.root, None)
+            with open(os.path.join(self.registry.version_dir(version), 'preprocessor.pkl'), 'ab') as f:
+                f.write(b'tampered')
+            self.assertFalse(self.registry.verify(version))
+            with self.assertLogs('core.analytics', 'ERROR') as logs:
+                analyzer = ExpenseSheetAnalyzer()
+        self.assertIsNone(analyzer.model_version)
+        self.assertIn('Checksum mismatch', '\n'.join(logs.output))
+
+
+class InstrumentationTests(SimpleTestCase):
+    # The test's own in-memory connections reuse the 'default' alias name
+    databases = {'default'}
+
+    def test_stage_counts_queries_on_every_alias(self):
+        from django.db.utils import ConnectionHandler
+        from .instrumentation import Instrumentation
+
+        handler = ConnectionHandler({
+            alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'} for alias in ('default', 'replica')
+        })
+        self.addCleanup(handler.close_all)
+        instrumentation = Instrumentation()
+        with mock.patch('core.instrumentation.connections', handler):
+            with instrumentation.stage('read'):
+                for alias in ('default', 'replica', 'replica'):
+                    with handler[alias].cursor() as cursor:
+                        cursor.execute('SELECT 1')
+        self.assertEqual(instrumentation.as_dict()['read']['queries'], 3)
+
+
+class MemoryProfilerTests(SimpleTestCase):
+    # Assertions leave a little room for memory other threads free meanwhile
+    MB = 1024 * 1024
+
+    def test_nested_stage_peaks_fold_into_the_parent(self):
+        from .instrumentation import MemoryProfiler
+
+        profiler = MemoryProfiler(top=0)
+        with profiler.stage('outer'):
+            block = bytearray(8 * self.MB)
+            del block
+            with profiler.stage('inner'):
+                block = bytearray(2 * self.MB)
+                del block
+            with profiler.stage('inner'):
+                kept = bytearray(self.MB)
+        stages = profiler.as_dict()
+        self.assertGreater(stages['outer']['peak_bytes'], 7.9 * self.MB)
+        # The outer stage's earlier peak does not leak into its children
+        self.assertGreater(stages['inner']['peak_bytes'], 1.9 * self.MB)
+        self.assertLess(stages['inner']['peak_bytes'], 3 * self.MB)
+        self.assertEqual(stages['inner']['calls'], 2)
+        self.assertGreater(stages['inner']['retained_bytes'], 0.9 * self.MB)
+        self.assertGreater(stages['outer']['retained_bytes'], 0.9 * self.MB)
+        del kept
+
+    def test_concurrent_stages_keep_their_peaks_and_tracing(self):
+        import threading
+        import tracemalloc
+        from .instrumentation import MemoryProfiler
+
+        profiler = MemoryProfiler(top=0)
+        first_allocated, second_started, first_done = threading.Event(), threading.Event(), threading.Event()
+
+        def first():
+            # Starts tracing, then ends while the second stage is still open
+            with profiler.stage('first'):
+                block = bytearray(8 * self.MB)
+                del block
+                first_allocated.set()
+                second_started.wait(10)
+            first_done.set()
+
+        def second():
+            first_allocated.wait(10)
+            with profiler.stage('second'):
+                second_started.set()
+                first_done.wait(10)
+                kept = bytearray(2 * self.MB)
+            del kept
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stages = profiler.as_dict()
+        self.assertGreater(stages['first']['peak_bytes'], 7.9 * self.MB)
+        self.assertGreater(stages['second']['peak_bytes'], 1.9 * self.MB)
+        self.assertGreater(stages['second']['retained_bytes'], 1.9 * self.MB)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class CompiledForestParityTests(SimpleTestCase):
+    """Compiled tree arrays must score exactly like the sklearn estimators they replace"""
+
+    def setUp(self):
+        import numpy as np
+
+        self.directory = tempfile.mkdtemp(prefix='compiled-forest-test-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        rng = np.random.default_rng(0)
+        self.X = rng.normal(size=(600, 6))
+        self.X[:20] += 6
+        self.y = (self.X[:, 0] + rng.normal(scale=0.5, size=600) > 1).astype(int)
+
+    def _compiled(self, estimator, name):
+        from .tree_engine import CompiledForest, compile_forest
+
+        return CompiledForest(compile_forest(estimator, self.directory, name), batch_size=128)
+
+    def test_isolation_forest(self):
+        import numpy as np
+        from sklearn.ensemble import IsolationForest
+
+        forest = IsolationForest(n_estimators=30, max_features=0.5, random_state=0).fit(self.X)
+        np.testing.assert_allclose(self._compiled(forest, 'iforest').score_samples(self.X), forest.score_samples(self.X))
+
+    def test_random_forest(self):
+        import numpy as np
+        from sklearn.ensemble import RandomForestClassifier
+
+        forest = RandomForestClassifier(n_estimators=20, max_depth=6, random_state=0).fit(self.X, self.y)
+        np.testing.assert_allclose(self._compiled(forest, 'rf').predict_proba(self.X), forest.predict_proba(self.X))
+
+    def test_windowed_forest(self):
+        import numpy as np
+        from sklearn.preprocessing import StandardScaler
+        from .windowed_forest import WindowedIsolationForest
+
+        forest = WindowedIsolationForest(n_estimators=10)
+        forest.partial_fit(self.X[:300], fitted_at=0)
+        forest.partial_fit(self.X[300:], fitted_at=3600)
+        scaler = StandardScaler().fit(self.X)
+        forest.set_input_scaling(scaler)
+        X_scaled = scaler.transform(self.X)
+        np.testing.assert_allclose(
+            self._compiled(forest, 'windowed').score_samples(X_scaled), forest.score_samples(X_scaled), rtol=1e-9
+        )
+
+
+class ModelScoringTests(SimpleTestCase):
+    """Batched positive-class probabilities used for random_forest_score and xgboost_score"""
+
+    def setUp(self):
+        import numpy as np
+        from .analytics import ExpenseSheetAnalyzer
+
+        model_dir = tempfile.mkdtemp(prefix='model-scoring-test-')
+        self.addCleanup(shutil.rmtree, model_dir, True)
+        with override_settings(ANALYTICS_MODEL_DIR=model_dir):
+            self.analyzer = ExpenseSheetAnalyzer()
+        rng = np.random.default_rng(0)
+        self.X = rng.normal(size=(500, 4))
+        self.y = (self.X[:, 0] > 1).astype(int)
+
+    def test_batches_match_a_single_predict_call(self):
+        import numpy as np
+        import xgboost
+        from sklearn.ensemble import RandomForestClassifier
+
+        for model in (
+            RandomForestClassifier(n_estimators=10, random_state=0),
+            xgboost.XGBClassifier(tree_method='hist', n_estimators=10, max_depth=3),
+        ):
+            model.fit(self.X, self.y)
+            expected = model.predict_proba(self.X)[:, 1]
+            # 500 rows in batches of 64 leave a short final batch
+            np.testing.assert_allclose(self.analyzer._predict_positive_proba(model, self.X, batch_size=64), expected, rtol=1e-6)
+            np.testing.assert_allclose(self.analyzer._predict_positive_proba(model, self.X), expected, rtol=1e-6)
+
+    def test_model_without_fraud_labels_scores_zero(self):
+        from sklearn.ensemble import RandomForestClassifier
+
+        model = RandomForestClassifier(n_estimators=5, random_state=0).fit(self.X, [0] * len(self.X))
+        self.assertEqual(self.analyzer._predict_positive_proba(model, self.X).tolist(), [0.0] * len(self.X))
+
+
+class TrainedModelScoringTests(TestCase):
+    def test_every_model_scores_sheets_and_reloads_unchanged(self):
+        from . import synthetic
+        from .analytics import ExpenseSheetAnalyzer, _model_cache
+
+        model_dir = tempfile.mkdtemp(prefix='trained-scoring-test-')
+        self.addCleanup(shutil.rmtree, model_dir, True)
+        sheets = [synthetic.create_sheet(f'scoring-{i}', synthetic.expense_frame(200, seed=i)) for i in range(3)]
+
+        def scores(analyzer):
+            analyzer.analyze_sheet(sheets[0])
+            return [
+                analysis.analysis_details['model_scores']
+                for analysis in ExpenseAnalysis.objects.filter(expense__expense_sheet=sheets[0]).order_by('expense_id')
+            ]
+
+        with override_settings(ANALYTICS_MODEL_DIR=model_dir):
+            analyzer = ExpenseSheetAnalyzer()
+            self.assertTrue(analyzer.train_models())
+            trained = scores(analyzer)
+            sheet_analysis = SheetAnalysis.objects.get(expense_sheet=sheets[0])
+
+            # A fresh process reads the published version, including the LOF neighbor index
+            _model_cache.pop(analyzer.registry.root, None)
+            reloaded = ExpenseSheetAnalyzer()
+            self.assertEqual(reloaded.model_version, analyzer.model_version)
+            reloaded_scores = scores(reloaded)
+
+        self.assertEqual(len(trained), 200)
+        for row in trained:
+            self.assertEqual(set(row), {'isolation_forest', 'random_forest', 'xgboost', 'lof'})
+            self.assertTrue(0 <= row['random_forest'] <= 1 and 0 <= row['xgboost'] <= 1)
+        self.assertGreater(sheet_analysis.random_forest_score, 0)
+        self.assertGreater(sheet_analysis.xgboost_score, 0)
+        self.assertLess(sheet_analysis.lof_score, 0)
+        for name in ('isolation_forest', 'random_forest', 'xgboost', 'lof'):
+            self.assertEqual(
+                [round(row[name], 6) for row in reloaded_scores], [round(row[name], 6) for row in trained], name
+            )
+
+
+class ParallelTrainingTests(TestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp(prefix='parallel-training-test-')
+        self.addCleanup(shutil.rmtree, self.model_dir, True)
+
+    def test_thread_allocation_stays_within_cpu_budget(self):
+        from .analytics import ExpenseSheetAnalyzer
+
+        names = ['isolation_forest', 'random_forest', 'xgboost', 'lof']
+        with override_settings(ANALYTICS_MODEL_DIR=self.model_dir):
+            analyzer = ExpenseSheetAnalyzer()
+        for cpu_budget in range(1, 12):
+            threads = analyzer._allocate_training_threads(names, cpu_budget, parallel=True)
+            # The pool runs at most cpu_budget fits at once; even the largest ones must fit
+            concurrent = sorted(threads.values(), reverse=True)[:min(len(names), cpu_budget)]
+            self.assertLessEqual(sum(concurrent), cpu_budget, threads)
+            self.assertTrue(all(n >= 1 for n in threads.values()))
+        self.assertEqual(
+            analyzer._allocate_training_threads(names, 8, parallel=True),
+            {'isolation_forest': 2, 'random_forest': 2, 'xgboost': 2, 'lof': 2}
+        )
+        self.assertEqual(set(analyzer._allocate_training_threads(names, 3, parallel=False).values()), {3})
+
+    def test_failing_model_is_skipped_and_the_others_publish(self):
+        from . import synthetic
+        from .analytics import ExpenseSheetAnalyzer
+
+        class FailingEstimator:
+            def set_params(self, **params):
+                return self
+
+            def fit(self, X, y=None):
+                raise RuntimeError('fit failed')
+
+        build_models = ExpenseSheetAnalyzer._build_models
+
+        def build_with_failing_xgboost(analyzer):
+            models = build_models(analyzer)
+            models['xgboost'] = FailingEstimator()
+            return models
+
+        sheets = [synthetic.create_sheet(f'parallel-{i}', synthetic.expense_frame(200, seed=i)) for i in range(3)]
+        with override_settings(ANALYTICS_MODEL_DIR=self.model_dir, ANALYTICS_TRAINING_CPU_BUDGET=2), \
+                mock.patch.object(ExpenseSheetAnalyzer, '_build_models', build_with_failing_xgboost):
+            analyzer = ExpenseSheetAnalyzer()
+            with self.assertLogs('core.analytics', 'ERROR') as logs:
+                self.assertTrue(analyzer.train_models(sheets))
+
+        self.assertIn('Error training xgboost', '\n'.join(logs.output))
+        self.assertEqual(sorted(analyzer.model_manifest['models']), ['isolation_forest', 'lof', 'random_forest'])
+        self.assertEqual(analyzer.training_report['mode'], 'parallel')
+        self.assertNotIn('xgboost', analyzer.training_report['model_timings'])
+        self.assertTrue(analyzer.registry.verify(analyzer.model_version))
+
+
+class ReservoirSamplerTests(SimpleTestCase):
+    def test_sample_leans_toward_recent_rows(self):
+        import numpy as np
+        from .sampling import StratifiedReservoirSampler
+
+        # Two years of rows spread evenly over time and three departments
+        rng = np.random.default_rng(0)
+        n_rows = 60000
+        timestamps = np.sort(rng.uniform(0, 720 * 86400, size=n_rows))
+        departments = rng.integers(0, 3, size=n_rows).tolist()
+        sampler = StratifiedReservoirSampler(capacity=3000, half_life_days=180)
+        for start in range(0, n_rows, 10000):
+            end = start + 10000
+            sampler.offer_many(departments[start:end], timestamps[start:end], range(start, end))
+
+        sampled = timestamps[np.fromiter(sampler.items(), dtype=np.int64)]
+        recent_share = np.mean(sampled >= 540 * 86400)
+        # The newest quarter of the population should be about half the sample (8/15)
+        self.assertEqual(len(sampled), 3000)
+        self.assertGreater(recent_share, 0.45)
+
+
+class FeatureStoreTests(SimpleTestCase):
+    def setUp(self):
+        from .feature_store import FeatureStore
+
+        self.root = tempfile.mkdtemp(prefix='feature-store-test-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.open_store = lambda: FeatureStore(self.root, ['a', 'b'], ['category'], version=1)
+
+    def _append(self, store, sheet_id, expense_ids, value):
+        n = len(expense_ids)
+        store.append(sheet_id, (n, max(expense_ids), sum(expense_ids)), [[value, value]] * n, [0] * n, [0.0] * n, expense_ids)
+
+    def test_append_commit_and_truncate_uncommitted_tail(self):
+        store = self.open_store()
+        with store.locked():
+            self._append(store, 1, [1, 2, 3], 1.0)
+            self.assertEqual(store.n_rows, 0)
+            store.commit()
+        self.assertEqual(store.n_rows, 3)
+        self.assertEqual(store.sheet_fingerprints, {1: (3, 3, 6)})
+
+        # A writer that crashes before commit leaves a tail the next writer removes
+        with store.locked():
+            self._append(store, 2, [4, 5], 2.0)
+        reopened = self.open_store()
+        self.assertEqual(reopened.n_rows, 3)
+        with reopened.locked():
+            self._append(reopened, 2, [4, 5], 3.0)
+            reopened.commit()
+        self.assertEqual(reopened.array('features')[:, 0].tolist(), [1.0, 1.0, 1.0, 3.0, 3.0])
+        self.assertEqual(reopened.array('expense_ids').tolist(), [1, 2, 3, 4, 5])
+
+    def test_replaced_and_removed_sheets_leave_live_rows(self):
+        store = self.open_store()
+        with store.locked():
+            self._append(store, 1, [1, 2], 1.0)
+            self._append(store, 2, [3], 2.0)
+            store.commit()
+        with store.locked():
+            self._append(store, 1, [1, 2, 4], 4.0)
+            store.remove_sheets([2])
+            store.commit()
+        self.assertEqual(store.live_mask().tolist(), [False, False, False, True, True, True])
+        self.assertEqual(store.watermark, 4)
+
+        with store.locked():
+            store.compact()
+        self.assertEqual(store.epoch, 1)
+        self.assertEqual(store.n_rows, 3)
+        self.assertEqual(store.array('features')[:, 0].tolist(), [4.0, 4.0, 4.0])
+        self.assertEqual(self.open_store().sheet_fingerprints, {1: (3, 4, 7)})
+
+
+class DriftTests(TestCase):
+    def test_scoring_training_data_does_not_trigger_retrain(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from . import synthetic
+        from .analytics import ExpenseSheetAnalyzer
+
+        model_dir = tempfile.mkdtemp(prefix='drift-test-')
+        self.addCleanup(shutil.rmtree, model_dir, True)
+        sheets = [
+            synthetic.create_sheet(f'drift-{i}', synthetic.expense_frame(300, seed=i), sheet_date=date(2024, 1, 1) + timedelta(days=i))
+            for i in range(5)
+        ]
+        with override_settings(ANALYTICS_MODEL_DIR=model_dir, ANALYTICS_DRIFT_MIN_ROWS=1000, ANALYTICS_DRIFT_MIN_SHEETS=5):
+            analyzer = ExpenseSheetAnalyzer()
+            self.assertTrue(analyzer.train_models())
+            analyzer._last_training_time = timezone.now()
+            for i, sheet in enumerate(sheets):
+                analyzer.analyze_sheet(sheet)
+                self.assertFalse(analyzer.evaluate_model_performance(), f'retrain recommended after {i + 1} sheet(s)')
+
+        report = analyzer.drift_report()
+        self.assertEqual(report['sheets'], 5)
+        self.assertLess(report['max_psi'], analyzer.training_config['drift_psi_threshold'])
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        from .stats import percentile
+
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 0.50), 5)
+        self.assertEqual(percentile(values, 0.95), 10)
+        self.assertEqual(percentile(values, 0.0), 1)
+        self.assertEqual(percentile(values, 1.0), 10)
+        self.assertEqual(percentile(list(range(1, 101)), 0.99), 99)
+        self.assertEqual(percentile(list(range(1, 101)), 0.07), 7)
+        self.assertEqual(percentile([7], 0.5), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    # The test's own file-backed connection reuses the 'default' alias name
+    databases = {'default'}
+
+    def test_fresh_connection_uses_configured_pragmas(self):
+        from django.db.utils import ConnectionHandler
+
+        directory = tempfile.mkdtemp(prefix='sqlite-tuning-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        # In-memory test databases cannot use WAL, so open a file with the project's OPTIONS
+        handler = ConnectionHandler({'default': {
+            'ENGINE': settings.DATABASES['default']['ENGINE'],
+            'NAME': os.path.join(directory, 'tuning.sqlite3'),
+            'OPTIONS': settings.DATABASES['default']['OPTIONS'],
+        }})
+        self.addCleanup(handler.close_all)
+        pragmas = settings.ANALYTICS_SQLITE_PRAGMAS
+        with handler['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], pragmas['journal_mode'].lower())
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], int(pragmas['busy_timeout']))
+        self.assertEqual(handler['default'].transaction_mode, settings.DATABASES['default']['OPTIONS']['transaction_mode'].upper())
+
+
+class WarmUpTests(TestCase):
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp(prefix='warm-up-test-')
+        self.addCleanup(shutil.rmtree, self.model_dir, True)
+
+    def test_start_warm_up_only_when_enabled(self):
+        from .apps import start_warm_up
+
+        report = {'total_seconds': 0.1, 'load_seconds': 0.05, 'scoring_seconds': 0.05, 'model_version': 'v1'}
+        with mock.patch('core.analytics.warm_up_models', return_value=report) as warm_up_models:
+            with override_settings(ANALYTICS_WARMUP_ON_STARTUP=False):
+                self.assertIsNone(start_warm_up())
+            with override_settings(ANALYTICS_WARMUP_ON_STARTUP=True), self.assertLogs('core.apps', 'INFO') as logs:
+                start_warm_up().join(10)
+        warm_up_models.assert_called_once_with()
+        self.assertIn('warm-up completed', logs.output[0])
+
+    def test_warm_up_scores_with_every_trained_model(self):
+        from . import synthetic
+        from .analytics import ExpenseSheetAnalyzer, warm_up_models
+
+        sheets = [synthetic.create_sheet(f'warm-up-{i}', synthetic.expense_frame(200, seed=i)) for i in range(3)]
+        with override_settings(ANALYTICS_MODEL_DIR=self.model_dir):
+            report = warm_up_models(n_rows=50)
+            self.assertIsNone(report['model_version'])
+            self.assertEqual(report['rows'], 50)
+
+            analyzer = ExpenseSheetAnalyzer()
+            self.assertTrue(analyzer.train_models(sheets))
+            report = warm_up_models(n_rows=50)
+        self.assertEqual(report['model_version'], analyzer.model_version)
+        self.assertEqual(sorted(report['models_ready']), ['isolation_forest', 'lof', 'random_forest', 'xgboost'])
+        self.assertGreaterEqual(report['total_seconds'], report['scoring_seconds'])
+
+
+class MetricsEndpointTests(TestCase):
+    def test_exposition_includes_request_metrics(self):
+        self.client.get('/api/expenses/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn(
+            'analytics_http_request_duration_seconds_count{method="GET",route="core:expense_list",status="200"}', body
+        )
+        self.assertIn('analytics_http_request_queries_count{route="core:expense_list"}', body)
+        self.assertIn('# TYPE analytics_rows_analyzed_total counter', body)
+
+
+@override_settings(ANALYTICS_PROFILING_TOKEN='profile-secret')
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='profiling-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.profile_dir = os.path.join(directory, 'profiles')
+        profile_dir = override_settings(ANALYTICS_PROFILE_DIR=self.profile_dir)
+        profile_dir.enable()
+        self.addCleanup(profile_dir.disable)
+
+    def test_requests_without_the_token_are_not_profiled(self):
+        for path, headers in (
+            ('/api/expenses/', {}),
+            ('/api/expenses/', {'HTTP_X_PROFILE': 'wrong'}),
+            ('/api/expenses/?profile=wrong', {}),
+            ('/api/expenses/', {'HTTP_X_PROFILE': ''}),
+        ):
+            response = self.client.get(path, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Profile-Id', response)
+        with override_settings(ANALYTICS_PROFILING_TOKEN=''):
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/expenses/', HTTP_X_PROFILE=''))
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+    def test_token_profiles_the_request(self):
+        response = self.client.get('/api/expenses/', HTTP_X_PROFILE='profile-secret', HTTP_X_REQUEST_ID='req-1')
+        self.assertEqual(response['X-Profile-Id'], 'req-1')
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, 'req-1.prof')))
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir, 'req-1.collapsed')))
+
+        # Request ids that are not safe file names are replaced
+        response = self.client.get('/api/expenses/?profile=profile-secret&profiler=sampling', HTTP_X_REQUEST_ID='../x')
+        request_id = response['X-Profile-Id']
+        self.assertNotEqual(request_id, '../x')
+        with open(os.path.join(self.profile_dir, 'index.jsonl')) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([entry['request_id'] for entry in entries], ['req-1', request_id])
+        self.assertEqual(entries[1]['profiler'], 'sampling')
+        self.assertEqual(entries[1]['files'], [f'{request_id}.collapsed'])
+        self.assertEqual(entries[0]['route'], 'core:expense_list')
+
+
+class ReadReplicaTests(SimpleTestCase):
+    def setUp(self):
+        from django.test import RequestFactory
+
+        directory = tempfile.mkdtemp(prefix='replica-test-')
+        self.addCleanup(shutil.rmtree, directory, True)
+        sync_file = override_settings(ANALYTICS_REPLICA_SYNC_FILE=os.path.join(directory, 'replica.synced'))
+        sync_file.enable()
+        self.addCleanup(sync_file.disable)
+        configured = mock.patch('core.middleware.replica_configured', return_value=True)
+        configured.start()
+        self.addCleanup(configured.stop)
+        self.factory = RequestFactory()
+
+    def _serve(self, request):
+        from .db import ReadReplicaRouter
+        from .middleware import ReadReplicaMiddleware
+
+        served_from = []
+
+        def view(request):
+            served_from.append(ReadReplicaRouter().db_for_read(ExpenseSheet))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        response = ReadReplicaMiddleware(view)(request)
+        return served_from[0], response
+
+    def test_router(self):
+        from .db import ReadReplicaRouter, use_replica
+
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(ExpenseSheet), 'default')
+        with use_replica():
+            self.assertEqual(router.db_for_read(ExpenseSheet), 'replica')
+            self.assertEqual(router.db_for_write(ExpenseSheet), 'default')
+        self.assertTrue(router.allow_migrate('default', 'core'))
+        self.assertFalse(router.allow_migrate('replica', 'core'))
+
+    def test_writer_reads_primary_until_a_sync_includes_the_write(self):
+        from .db import record_replica_sync
+        from .middleware import LAST_WRITE_COOKIE
+
+        self.assertEqual(self._serve(self.factory.get('/api/expenses/'))[0], 'replica')
+        db, response = self._serve(self.factory.post('/api/expenses/upload/'))
+        self.assertEqual(db, 'default')
+        last_write = response.cookies[LAST_WRITE_COOKIE].value
+
+        # A sync that started before the write does not contain it, however old the write gets
+        record_replica_sync(float(last_write) - 1)
+        request = self.factory.get('/api/expenses/')
+        request.COOKIES[LAST_WRITE_COOKIE] = last_write
+        self.assertEqual(self._serve(request)[0], 'default')
+
+        record_replica_sync(float(last_write) + 1)
+        db, response = self._serve(request)
+        self.assertEqual(db, 'replica')
+        self.assertEqual(response.cookies[LAST_WRITE_COOKIE].value, '')
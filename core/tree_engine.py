@@ -0,0 +1,186 @@
+import json
+import os
+from .lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+COMPILED_DIR = 'compiled'
+NODE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+META_FILE = 'meta.json'
+
+
+def _average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search (matches sklearn's IsolationForest)"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n_samples)
+    result[n_samples == 2] = 1.0
+    mask = n_samples > 2
+    result[mask] = 2.0 * (np.log(n_samples[mask] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[mask] - 1.0) / n_samples[mask]
+    return result
+
+
+def _isolation_trees(forest):
+    """(tree, feature subset, path length normalizer) for each tree of an IsolationForest"""
+    denominator = _average_path_length([forest.max_samples_])[0]
+    return [(tree, features, denominator) for tree, features in zip(forest.estimators_, forest.estimators_features_)]
+
+
+def compile_forest(estimator, directory, name):
+    """Export a fitted IsolationForest, WindowedIsolationForest or RandomForestClassifier as flat node arrays
+
+    All trees are concatenated into one set of arrays; ``roots`` holds the index of each
+    tree's root node and leaves carry their final per-tree contribution in ``value``.
+    Returns the output directory, or None when the estimator cannot be compiled.
+    """
+    kind = type(estimator).__name__
+    n_features = estimator.n_features_in_
+    input_mean = input_scale = None
+
+    if kind == 'IsolationForest':
+        # Leaf value is the normalized path length, so score = -2 ** -mean(value)
+        trees = _isolation_trees(estimator)
+    elif kind == 'WindowedIsolationForest':
+        # Generations score like one forest; thresholds move into the scaled input space
+        kind = 'IsolationForest'
+        trees = [tree for forest in estimator.forests for tree in _isolation_trees(forest)]
+        input_mean, input_scale = estimator.input_mean, estimator.input_scale
+    elif kind == 'RandomForestClassifier':
+        classes = list(estimator.classes_)
+        if 1 not in classes:
+            return None
+        positive_index = classes.index(1)
+        trees = [(tree, None, None) for tree in estimator.estimators_]
+    else:
+        return None
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for tree, tree_features, denominator in trees:
+        t = tree.tree_
+        is_leaf = t.children_left < 0
+
+        feature = t.feature.astype(np.int32)
+        if tree_features is not None and len(tree_features) != n_features:
+            # Trees fitted on a feature subset index into that subset
+            feature = np.where(is_leaf, feature, np.asarray(tree_features)[np.maximum(feature, 0)])
+        feature = np.where(is_leaf, -1, feature).astype(np.int32)
+
+        threshold = t.threshold.astype(np.float64)
+        if input_mean is not None:
+            safe_feature = np.maximum(feature, 0)
+            threshold = np.where(is_leaf, threshold, (threshold - input_mean[safe_feature]) / input_scale[safe_feature])
+
+        depths = t.compute_node_depths()
+        max_depth = max(max_depth, int(depths.max()))
+
+        if kind == 'IsolationForest':
+            path_lengths = depths + _average_path_length(t.n_node_samples) - 1.0
+            value = path_lengths / denominator if denominator > 0 else np.zeros(t.node_count)
+        else:
+            node_values = t.value[:, 0, :]
+            totals = node_values.sum(axis=1)
+            value = np.divide(node_values[:, positive_index], totals, out=np.zeros(t.node_count), where=totals > 0)
+
+        features.append(feature)
+        thresholds.append(threshold)
+        lefts.append(np.where(is_leaf, -1, t.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, -1, t.children_right + offset).astype(np.int32))
+        values.append(value.astype(np.float64))
+        roots.append(offset)
+        offset += t.node_count
+
+    output_dir = os.path.join(directory, COMPILED_DIR, name)
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'left': np.concatenate(lefts),
+        'right': np.concatenate(rights),
+        'value': np.concatenate(values),
+        'roots': np.asarray(roots, dtype=np.int32)
+    }
+    for array_name, array in arrays.items():
+        np.save(os.path.join(output_dir, f'{array_name}.npy'), array)
+
+    with open(os.path.join(output_dir, META_FILE), 'w') as f:
+        json.dump({
+            'kind': kind,
+            'n_trees': len(roots),
+            'n_features': int(n_features),
+            'max_depth': max_depth
+        }, f)
+
+    return output_dir
+
+
+class CompiledForest:
+    """Vectorized NumPy traversal over memory-mapped tree arrays
+
+    Exposes ``score_samples`` for isolation forests and ``predict_proba``/``classes_``
+    for classifiers so it can stand in for the sklearn estimator at inference time.
+    """
+
+    # Rows per traversal batch; each batch holds several n_rows x n_trees int64 cursor arrays
+    DEFAULT_BATCH_SIZE = 8192
+
+    def __init__(self, directory, mmap_mode='r', batch_size=DEFAULT_BATCH_SIZE):
+        with open(os.path.join(directory, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.kind = self.meta['kind']
+        self.n_features_in_ = self.meta['n_features']
+        self.max_depth = self.meta['max_depth']
+        self.batch_size = batch_size
+        self.classes_ = np.array([0, 1])
+
+        # Read-only maps let every worker process share the same page cache
+        for array_name in NODE_ARRAYS:
+            setattr(self, array_name, np.load(os.path.join(directory, f'{array_name}.npy'), mmap_mode=mmap_mode))
+        self.roots = np.asarray(self.roots)
+
+    @classmethod
+    def exists(cls, directory):
+        return os.path.exists(os.path.join(directory, META_FILE))
+
+    def _mean_leaf_values(self, X):
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has {X.shape[1]} features, but the compiled forest expects {self.n_features_in_}")
+
+        n_trees = len(self.roots)
+        result = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), self.batch_size):
+            batch = X[start:start + self.batch_size]
+            flat_batch = batch.ravel()
+            n_rows = len(batch)
+
+            # One cursor per (row, tree) pair; only pairs still on an internal node advance.
+            # Every cursor reaches a leaf within max_depth steps.
+            nodes = np.tile(self.roots, n_rows)
+            row_offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * batch.shape[1], n_trees)
+            active = np.arange(n_rows * n_trees)
+
+            for _ in range(self.max_depth):
+                current = nodes[active]
+                feature = self.feature[current]
+                internal = feature >= 0
+                active = active[internal]
+                if not active.size:
+                    break
+                current = current[internal]
+                go_left = flat_batch[row_offsets[active] + feature[internal]] <= self.threshold[current]
+                nodes[active] = np.where(go_left, self.left[current], self.right[current])
+
+            result[start:start + n_rows] = self.value[nodes].reshape(n_rows, n_trees).mean(axis=1)
+        return result
+
+    def score_samples(self, X):
+        """Isolation forest anomaly score, identical to IsolationForest.score_samples"""
+        return -(2.0 ** -self._mean_leaf_values(X))
+
+    def predict_proba(self, X):
+        """Class probabilities, identical to RandomForestClassifier.predict_proba"""
+        positive = self._mean_leaf_values(X)
+        return np.column_stack([1.0 - positive, positive])
@@ -13,6 +13,8 @@ urlpatterns = [
     path('sheets/<int:sheet_id>/', views.ExpenseSheetView.as_view(), name='expense_sheet_detail'),
     path('sheets/<int:sheet_id>/analyze/', views.SheetAnalysisView.as_view(), name='sheet_analysis'),
     path('analysis/train/', views.ModelTrainingView.as_view(), name='model_training'),
+    path('analysis/drift/', views.ModelDriftView.as_view(), name='model_drift'),
+    path('analysis/timings/', views.AnalysisTimingsView.as_view(), name='analysis_timings'),
     path('analysis/bulk/', views.BulkAnalysisView.as_view(), name='bulk_analysis'),
     path('analysis/session/<str:session_id>/', views.AnalysisSessionView.as_view(), name='analysis_session'),
 ] 
\ No newline at end of file
@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.db import connection
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -7,15 +8,81 @@ from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 import csv
 import io
-import traceback
+import logging
 import os
 from datetime import datetime, date
 from .models import Expense, ExpenseAnalysis, AnalysisSession, ExpenseSheet, SheetAnalysis
 from .serializers import ExpenseSerializer, ExpenseSheetSerializer
 from .analytics import ExpenseSheetAnalyzer
+from .instrumentation import aggregate_timings
+from .profiling import profiling_authorized
+from . import metrics
+
+logger = logging.getLogger(__name__)
+# Per-row upload events, sampled by the logging config
+row_logger = logging.getLogger(f'{__name__}.rows')
 
 # Create your views here.
 
+def _flag(request, name):
+    return request.query_params.get(name, '').lower() in ('1', 'true', 'yes')
+
+def _analyzer(request):
+    """Analyzer for this request, memory-profiled with ?memory=1 when DEBUG or profiling is authorized"""
+    memory_profile = _flag(request, 'memory') and (settings.DEBUG or profiling_authorized(request))
+    return ExpenseSheetAnalyzer(memory_profile=memory_profile)
+
+def _with_timings(request, analyzer, data):
+    """Attach the analyzer's per-stage timings when requested with ?timings=1, and its memory profile"""
+    if analyzer is not None and _flag(request, 'timings'):
+        data['_timings'] = analyzer.instrumentation.as_dict()
+    if analyzer is not None and analyzer.instrumentation.memory is not None:
+        data['_memory'] = analyzer.instrumentation.memory_dict()
+    return data
+
+def _flagged_expenses(expense_sheet):
+    """Expenses of a sheet with a positive fraud score, highest first, in a single query"""
+    expenses = (
+        expense_sheet.expenses
+        .filter(analysis__fraud_score__gt=0)
+        .select_related('analysis')
+        .order_by('-analysis__fraud_score', 'id')
+    )
+    flagged_expenses = []
+    for expense in expenses:
+        analysis = expense.analysis
+        flagged_expenses.append({
+            'expense_id': expense.id,
+            'description': expense.description,
+            'amount': str(expense.amount),
+            'employee': expense.employee,
+            'department': expense.department,
+            'date': expense.date,
+            'vendor': expense.vendor_supplier,
+            'category': expense.category,
+            'fraud_score': analysis.fraud_score,
+            'risk_level': analysis.risk_level,
+            'anomaly_reasons': analysis.analysis_details.get('anomaly_reasons', []),
+            'fraud_score_breakdown': analysis.analysis_details.get('fraud_score_breakdown', {}),
+            'anomaly_flags': {
+                'amount_anomaly': analysis.amount_anomaly,
+                'timing_anomaly': analysis.timing_anomaly,
+                'vendor_anomaly': analysis.vendor_anomaly,
+                'employee_anomaly': analysis.employee_anomaly,
+                'duplicate_suspicion': analysis.duplicate_suspicion,
+            }
+        })
+    return flagged_expenses
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint (aggregated across workers in multiprocess mode)
+    """
+    if not metrics.enabled():
+        return HttpResponse('prometheus-client is not installed\n', status=503, content_type='text/plain')
+    body, content_type = metrics.exposition()
+    return HttpResponse(body, content_type=content_type)
+
 def test_db_connection(request):
     """
     Simple view to test database connection
@@ -92,7 +159,10 @@ class ExpenseUploadView(APIView):
             
             # Ensure the sheet is saved and we have the ID
             expense_sheet.save()
-            print(f"Created/Found ExpenseSheet: ID={expense_sheet.id}, Name={expense_sheet.sheet_name}, Date={expense_sheet.sheet_date}")
+            logger.info(
+                "Expense sheet %s for upload", 'created' if created else 'found',
+                extra={'sheet_id': expense_sheet.id, 'sheet_name': expense_sheet.sheet_name, 'sheet_date': expense_sheet.sheet_date}
+            )
             
             decoded_file = file_obj.read().decode('utf-8')
             io_string = io.StringIO(decoded_file)
@@ -103,12 +173,12 @@ class ExpenseUploadView(APIView):
             expenses = []
             total_amount = 0
             
+            # Per-row events are DEBUG and sampled; skip building them when DEBUG is off
+            log_rows = row_logger.isEnabledFor(logging.DEBUG)
+            
             for row in reader:
-                print(row)
                 # Normalize row keys
                 normalized_row = {normalize_key(k): v for k, v in row.items()}
-                print(f"normalized_row: {normalized_row}")
-                print(f"FIELD_MAP: {FIELD_MAP}")
 
                 # Convert date to YYYY-MM-DD
                 if 'Date' in normalized_row and normalized_row['Date']:
@@ -121,13 +191,10 @@ class ExpenseUploadView(APIView):
                 expense_data = {model_field: normalized_row.get(csv_field, None) for model_field, csv_field in FIELD_MAP.items()}
                 expense_data['expense_sheet_id'] = expense_sheet.id
                 
-                print(f"expense_data: {expense_data}")
-                print(f"expense_sheet_id being set: {expense_sheet.id}")
-                print(f"expense_data keys: {list(expense_data.keys())}")
+                if log_rows:
+                    row_logger.debug("Upload row parsed", extra={'sheet_id': expense_sheet.id, 'expense_data': expense_data})
                 serializer = ExpenseSerializer(data=expense_data)
-                print(f"Serializer is_valid: {serializer.is_valid()}")
                 if serializer.is_valid():
-                    print(f"Validated data: {serializer.validated_data}")
                     expense = serializer.save()
                     expenses.append(serializer.data)
                     
@@ -135,7 +202,10 @@ class ExpenseUploadView(APIView):
                     if expense.amount:
                         total_amount += expense.amount
                 else:
-                    print(f"Serializer errors: {serializer.errors}")
+                    logger.warning(
+                        "Upload row rejected",
+                        extra={'sheet_id': expense_sheet.id, 'row': row, 'errors': serializer.errors}
+                    )
                     return Response({'error': serializer.errors, 'row': row}, status=status.HTTP_400_BAD_REQUEST)
             
             # Update expense sheet with totals
@@ -144,14 +214,14 @@ class ExpenseUploadView(APIView):
             expense_sheet.save()
             
             # Auto-train models after new sheet upload
+            analyzer = None
             try:
-                analyzer = ExpenseSheetAnalyzer()
-                analyzer.auto_train_if_needed()
-                training_status = "Models auto-trained" if analyzer._last_training_time else "No training needed"
+                analyzer = _analyzer(request)
+                training_status = "Models auto-trained" if analyzer.auto_train_if_needed() else "No training needed"
             except Exception as e:
                 training_status = f"Training failed: {str(e)}"
             
-            return Response({
+            return Response(_with_timings(request, analyzer, {
                 'message': 'Expenses uploaded successfully.',
                 'sheet_info': {
                     'sheet_name': expense_sheet.sheet_name,
@@ -161,14 +231,14 @@ class ExpenseUploadView(APIView):
                 },
                 'training_status': training_status,
                 'data': expenses
-            }, status=status.HTTP_201_CREATED)
+            }), status=status.HTTP_201_CREATED)
         except Exception as e:
-            traceback.print_exc()
+            logger.exception("Expense upload failed")
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 class ExpenseListView(APIView):
     def get(self, request, format=None):
-        expense_sheets = ExpenseSheet.objects.all().order_by('-sheet_date', '-uploaded_at')
+        expense_sheets = ExpenseSheet.objects.select_related('analysis').order_by('-sheet_date', '-uploaded_at')
         sheet_data = []
         
         for sheet in expense_sheets:
@@ -211,7 +281,7 @@ class ExpenseAnalysisView(APIView):
     """
     def get(self, request, expense_id, format=None):
         try:
-            expense = Expense.objects.get(id=expense_id)
+            expense = Expense.objects.select_related('expense_sheet').get(id=expense_id)
             analysis = ExpenseAnalysis.objects.get(expense=expense)
             
             return Response({
@@ -281,7 +351,7 @@ class ExpenseSheetView(APIView):
     def get(self, request, sheet_id, format=None):
         try:
             expense_sheet = ExpenseSheet.objects.get(id=sheet_id)
-            expenses = expense_sheet.expenses.all()
+            expenses = expense_sheet.expenses.select_related('analysis')
             
             expense_data = []
             for expense in expenses:
@@ -327,7 +397,7 @@ class DebugExpenseView(APIView):
     """
     def get(self, request, expense_id, format=None):
         try:
-            expense = Expense.objects.get(id=expense_id)
+            expense = Expense.objects.select_related('expense_sheet', 'analysis').get(id=expense_id)
             
             return Response({
                 'expense_id': expense.id,
@@ -347,7 +417,7 @@ class SheetAnalysisView(APIView):
     def post(self, request, sheet_id, format=None):
         try:
             expense_sheet = ExpenseSheet.objects.get(id=sheet_id)
-            analyzer = ExpenseSheetAnalyzer()
+            analyzer = _analyzer(request)
             
             # Auto-train before analysis
             training_status = "No training needed"
@@ -362,37 +432,7 @@ class SheetAnalysisView(APIView):
             
             if sheet_analysis:
                 # Get flagged expenses with detailed reasons
-                flagged_expenses = []
-                for expense in expense_sheet.expenses.all():
-                    try:
-                        analysis = expense.analysis
-                        if analysis.fraud_score > 0:  # Only include flagged expenses
-                            flagged_expenses.append({
-                                'expense_id': expense.id,
-                                'description': expense.description,
-                                'amount': str(expense.amount),
-                                'employee': expense.employee,
-                                'department': expense.department,
-                                'date': expense.date,
-                                'vendor': expense.vendor_supplier,
-                                'category': expense.category,
-                                'fraud_score': analysis.fraud_score,
-                                'risk_level': analysis.risk_level,
-                                'anomaly_reasons': analysis.analysis_details.get('anomaly_reasons', []),
-                                'fraud_score_breakdown': analysis.analysis_details.get('fraud_score_breakdown', {}),
-                                'anomaly_flags': {
-                                    'amount_anomaly': analysis.amount_anomaly,
-                                    'timing_anomaly': analysis.timing_anomaly,
-                                    'vendor_anomaly': analysis.vendor_anomaly,
-                                    'employee_anomaly': analysis.employee_anomaly,
-                                    'duplicate_suspicion': analysis.duplicate_suspicion,
-                                }
-                            })
-                    except ExpenseAnalysis.DoesNotExist:
-                        continue
-                
-                # Sort by fraud score (highest first)
-                flagged_expenses.sort(key=lambda x: x['fraud_score'], reverse=True)
+                flagged_expenses = _flagged_expenses(expense_sheet)
                 
                 # Get advanced metrics from analysis_details
                 analysis_details = getattr(sheet_analysis, 'analysis_details', {})
@@ -421,7 +461,7 @@ class SheetAnalysisView(APIView):
                 # Get chart data
                 chart_data = analysis_details.get('chart_data', {})
                 
-                return Response({
+                return Response(_with_timings(request, analyzer, {
                     'message': 'Sheet analysis completed successfully',
                     'sheet_id': sheet_id,
                     'sheet_name': expense_sheet.sheet_name,
@@ -449,7 +489,7 @@ class SheetAnalysisView(APIView):
                     'chart_data': chart_data,
                     'flagged_expenses': flagged_expenses,
                     'analysis_timestamp': sheet_analysis.updated_at.isoformat()
-                }, status=status.HTTP_200_OK)
+                }), status=status.HTTP_200_OK)
             else:
                 return Response({
                     'error': 'Analysis failed - insufficient data'
@@ -458,8 +498,7 @@ class SheetAnalysisView(APIView):
         except ExpenseSheet.DoesNotExist:
             return Response({'error': 'Expense sheet not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            logger.exception("Sheet analysis failed", extra={'sheet_id': sheet_id})
             return Response({'error': f'Analysis failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 class ModelTrainingView(APIView):
@@ -467,7 +506,7 @@ class ModelTrainingView(APIView):
     
     def post(self, request, format=None):
         try:
-            analyzer = ExpenseSheetAnalyzer()
+            analyzer = _analyzer(request)
             
             # Get all sheets for training
             sheets = ExpenseSheet.objects.all()
@@ -478,14 +517,15 @@ class ModelTrainingView(APIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
             
             # Train models
-            success = analyzer.train_models(sheets)
+            success = analyzer.train_models()
             
             if success:
-                return Response({
+                return Response(_with_timings(request, analyzer, {
                     'message': 'Models trained successfully',
+                    'model_version': analyzer.model_version,
                     'sheets_used': sheets.count(),
                     'models_trained': list(analyzer.models.keys())
-                }, status=status.HTTP_200_OK)
+                }), status=status.HTTP_200_OK)
             else:
                 return Response({
                     'error': 'Model training failed - insufficient data'
@@ -499,17 +539,19 @@ class ModelTrainingView(APIView):
     def get(self, request, format=None):
         """Get training status and model information"""
         try:
-            analyzer = ExpenseSheetAnalyzer()
+            analyzer = _analyzer(request)
             
             # Check if models exist
             model_files = []
             for name in analyzer.models.keys():
-                model_file = os.path.join(analyzer.model_path, f'{name}_model.pkl')
+                model_file = analyzer.get_model_file(name)
                 if os.path.exists(model_file):
                     model_files.append(name)
             
             return Response({
                 'models_available': model_files,
+                'model_version': analyzer.model_version,
+                'trained_at': analyzer.model_manifest.get('trained_at'),
                 'total_sheets': ExpenseSheet.objects.count(),
                 'sheets_with_analysis': SheetAnalysis.objects.count(),
                 'training_ready': ExpenseSheet.objects.count() >= 2  # Need at least 2 sheets for training
@@ -520,12 +562,43 @@ class ModelTrainingView(APIView):
                 'error': f'Failed to get training status: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ModelDriftView(APIView):
+    """Feature drift of analyzed data against the served model's training baseline"""
+    
+    def get(self, request, format=None):
+        try:
+            analyzer = _analyzer(request)
+            report = analyzer.drift_report()
+            
+            if report is None:
+                return Response({
+                    'error': 'No drift baseline available - train models first'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
+            report['psi_threshold'] = analyzer.training_config['drift_psi_threshold']
+            report['drifted_features'] = sorted(
+                name for name, value in report['psi'].items() if value >= report['psi_threshold']
+            )
+            report['retrain_recommended'] = analyzer.evaluate_model_performance()
+            return Response(report, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response({
+                'error': f'Failed to get drift report: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class AnalysisTimingsView(APIView):
+    """Per-stage timings aggregated over every analysis and training run in this process"""
+    
+    def get(self, request, format=None):
+        return Response({'stages': aggregate_timings()}, status=status.HTTP_200_OK)
+
 class BulkAnalysisView(APIView):
     """Analyze all expense sheets"""
     
     def post(self, request, format=None):
         try:
-            analyzer = ExpenseSheetAnalyzer()
+            analyzer = _analyzer(request)
             
             # Auto-train before bulk analysis
             training_status = "No training needed"
@@ -544,34 +617,7 @@ class BulkAnalysisView(APIView):
                     sheet_analysis = analyzer.analyze_sheet(sheet)
                     if sheet_analysis:
                         # Get flagged expenses for this sheet
-                        sheet_flagged_expenses = []
-                        for expense in sheet.expenses.all():
-                            try:
-                                analysis = expense.analysis
-                                if analysis.fraud_score > 0:  # Only include flagged expenses
-                                    sheet_flagged_expenses.append({
-                                        'expense_id': expense.id,
-                                        'description': expense.description,
-                                        'amount': str(expense.amount),
-                                        'employee': expense.employee,
-                                        'department': expense.department,
-                                        'date': expense.date,
-                                        'vendor': expense.vendor_supplier,
-                                        'category': expense.category,
-                                        'fraud_score': analysis.fraud_score,
-                                        'risk_level': analysis.risk_level,
-                                        'anomaly_reasons': analysis.analysis_details.get('anomaly_reasons', []),
-                                        'fraud_score_breakdown': analysis.analysis_details.get('fraud_score_breakdown', {}),
-                                        'anomaly_flags': {
-                                            'amount_anomaly': analysis.amount_anomaly,
-                                            'timing_anomaly': analysis.timing_anomaly,
-                                            'vendor_anomaly': analysis.vendor_anomaly,
-                                            'employee_anomaly': analysis.employee_anomaly,
-                                            'duplicate_suspicion': analysis.duplicate_suspicion,
-                                        }
-                                    })
-                            except ExpenseAnalysis.DoesNotExist:
-                                continue
+                        sheet_flagged_expenses = _flagged_expenses(sheet)
                         
                         # Add to all flagged expenses
                         all_flagged_expenses.extend(sheet_flagged_expenses)
@@ -650,7 +696,7 @@ class BulkAnalysisView(APIView):
                 avg_fraud_score = 0
                 high_risk_sheets = 0
             
-            return Response({
+            return Response(_with_timings(request, analyzer, {
                 'message': f'Bulk analysis completed. {successful_sheets}/{total_sheets} sheets analyzed successfully.',
                 'training_status': training_status,
                 'summary': {
@@ -663,11 +709,10 @@ class BulkAnalysisView(APIView):
                 },
                 'results': results,
                 'all_flagged_expenses': all_flagged_expenses
-            }, status=status.HTTP_200_OK)
+            }), status=status.HTTP_200_OK)
             
         except Exception as e:
-            import traceback
-            traceback.print_exc()
+            logger.exception("Bulk analysis failed")
             return Response({
                 'error': f'Bulk analysis failed: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,113 @@
+import time
+from .lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+sklearn_ensemble = lazy_import('sklearn.ensemble')
+
+
+class WindowedIsolationForest:
+    """Rolling isolation forest made of generations fitted on successive batches of rows
+
+    Each ``partial_fit`` fits a small IsolationForest on new rows only and appends it as a
+    generation; generations older than ``window_hours`` are dropped. Scores average the
+    normalized path lengths of every live tree, exactly as a single forest holding all
+    of them would, so an update costs time proportional to the new rows, not the history.
+
+    Generations are fitted on unscaled encoded rows because the scaler is refitted on
+    every training run; ``set_input_scaling`` records the scaling of the matrices passed
+    at inference so they can be mapped back before scoring.
+    """
+
+    # Same decision threshold as IsolationForest(contamination='auto')
+    offset_ = -0.5
+
+    def __init__(self, window_hours=168, n_estimators=25, random_state=42):
+        self.window_hours = window_hours
+        self.n_estimators = n_estimators
+        self.random_state = random_state
+        self.n_jobs = None
+        self.generations = []  # {'fitted_at', 'n_rows', 'forest'} oldest first
+        self.row_watermark = 0  # Caller-defined position of the last row fitted
+        self.row_epoch = 0  # Caller-defined generation of the row positions
+        self.input_mean = None
+        self.input_scale = None
+        self._fitted_generations = 0
+
+    @property
+    def forests(self):
+        return [generation['forest'] for generation in self.generations]
+
+    @property
+    def n_features_in_(self):
+        return self.generations[-1]['forest'].n_features_in_
+
+    def get_params(self, deep=True):
+        return {
+            'window_hours': self.window_hours,
+            'n_estimators': self.n_estimators,
+            'random_state': self.random_state,
+            'n_jobs': self.n_jobs
+        }
+
+    def set_params(self, **params):
+        for key, value in params.items():
+            setattr(self, key, value)
+        if 'n_jobs' in params:
+            for forest in self.forests:
+                forest.set_params(n_jobs=params['n_jobs'])
+        return self
+
+    def set_input_scaling(self, scaler):
+        """Record the StandardScaler applied to inputs of ``score_samples``"""
+        self.input_mean = np.asarray(scaler.mean_, dtype=np.float64).copy()
+        self.input_scale = np.asarray(scaler.scale_, dtype=np.float64).copy()
+        return self
+
+    def expire(self, now=None):
+        """Drop generations fitted before the window"""
+        cutoff = (time.time() if now is None else now) - self.window_hours * 3600
+        self.generations = [g for g in self.generations if g['fitted_at'] >= cutoff]
+        return self
+
+    def partial_fit(self, X, fitted_at=None):
+        """Fit a new generation on unscaled rows and expire generations outside the window"""
+        fitted_at = time.time() if fitted_at is None else fitted_at
+        forest = sklearn_ensemble.IsolationForest(
+            n_estimators=self.n_estimators,
+            contamination='auto',
+            random_state=self.random_state + self._fitted_generations,
+            n_jobs=self.n_jobs
+        )
+        forest.fit(np.asarray(X, dtype=np.float64))
+        self._fitted_generations += 1
+        self.generations.append({'fitted_at': fitted_at, 'n_rows': int(len(X)), 'forest': forest})
+        return self.expire(fitted_at)
+
+    def fit(self, X):
+        """Replace every generation with one fitted on ``X``"""
+        self.generations = []
+        return self.partial_fit(X)
+
+    def _unscale(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.input_mean is None:
+            return X
+        return X * self.input_scale + self.input_mean
+
+    def score_samples(self, X):
+        """Anomaly score over all live trees, on the IsolationForest.score_samples scale"""
+        if not self.generations:
+            raise ValueError("WindowedIsolationForest has no fitted generations")
+        X = self._unscale(X)
+
+        weighted_depth = np.zeros(len(X), dtype=np.float64)
+        n_trees = 0
+        for forest in self.forests:
+            # score = -2 ** -mean normalized depth, so invert it per generation
+            depth = -np.log2(-forest.score_samples(X))
+            weighted_depth += depth * len(forest.estimators_)
+            n_trees += len(forest.estimators_)
+        return -(2.0 ** -(weighted_depth / n_trees))
+
+    def predict(self, X):
+        return np.where(self.score_samples(X) < self.offset_, -1, 1)